@@ -0,0 +1,104 @@
+import argparse
+import configparser
+import time
+from lib.LaunchPad import *
+from lib.Sequencer import *
+from lib.MidiBackend import *
+
+#
+# Offline timing benchmark, runs the real sequencer against the recording MIDI backend
+# so it needs no hardware. Every track plays a full 32 step pattern, timings come from
+# the timestamps the backend put on each message as it was sent
+#
+
+def percentiles(values):
+   if(len(values) == 0): return 0.0, 0.0, 0.0
+   values = sorted(values)
+   return values[int(len(values) * 0.5)], values[min(len(values) - 1, int(len(values) * 0.99))], values[-1]
+
+# Long press the first pattern of track 0 into edit mode, then keep toggling notes on it
+def mashScript(presses_per_sec, secs):
+   script = [(0.0, [NOTE_ON, 0, 127]), (LONG_PRESS + 0.1, [NOTE_ON, 0, 0])]
+   t = LONG_PRESS + 0.2
+   n = 0
+   while t < secs:
+      note = ((7 - (n % 8)) * 16) + ((n * 3) % 8)
+      script.append((t, [NOTE_ON, note, 127]))
+      script.append((t + 0.01, [NOTE_ON, note, 0]))
+      t += 1.0 / presses_per_sec
+      n += 1
+   return script
+
+def run(config, bpm, bars, tracks, steps, mash, performance):
+   config['global']['bpm'] = str(bpm)
+   config['global']['telemetry_dump'] = '0'
+   config['global']['performance'] = 'yes' if performance else 'no'
+   backend = RecordingBackend()
+   lp_out = int(config['global']['lp_midi_out'])
+   seq_out = int(config['global']['midi_out'])
+   lp = LaunchPad(int(config['global']['lp_midi_in']), lp_out, backend)
+   seq = Sequencer(lp, config, backend)
+
+   for t in range(tracks):
+      pat = seq.tracks[t].patterns[0]
+      pat.loadSteps([{"note": 36 + t + (s % 12), "vel": 100, "gate": 0.5} for s in range(steps)])
+      seq.tracks[t].playPattern(0)
+
+   step_time = (60.0 / bpm) / 4.0
+   run_time = bars * 16 * step_time
+   # patterns launch on the next bar, so start the clock on the first note
+   while not any(msg[0] & 0xF0 == NOTE_ON for ts, msg in backend.sent(seq_out)): time.sleep(0.001)
+   if(mash > 0): backend.playInput(int(config['global']['lp_midi_in']), mashScript(mash, run_time))
+   start = time.perf_counter()
+   cpu_start = time.process_time()
+   time.sleep(run_time)
+   cpu = time.process_time() - cpu_start
+   wall = time.perf_counter() - start
+   seq.display.quit()
+   seq.scheduler.quit()
+   lp.close()
+
+   # onsets against an ideal grid from each channel's first note, rounding copes with mashed out notes
+   errors = []
+   drift = 0.0
+   for ch in range(tracks):
+      onsets = [ts for ts, msg in backend.sent(seq_out) if msg[0] == (NOTE_ON | ch) and ts <= start + run_time]
+      if(len(onsets) < 2): continue
+      err = [(ts - onsets[0]) - (round((ts - onsets[0]) / step_time) * step_time) for ts in onsets]
+      errors += [abs(e) * 1000.0 for e in err]
+      drift = max(drift, abs(err[-1]) * 1000.0)
+
+   # input to LED latency, from each release to the next Launchpad message
+   led = []
+   if(mash > 0):
+      lp_sent = [ts for ts, msg in backend.sent(lp_out)]
+      for ts, msg in backend.inputs[int(config['global']['lp_midi_in'])].received:
+         after = [t for t in lp_sent if t >= ts]
+         if(msg[2] == 0 and len(after) > 0): led.append((after[0] - ts) * 1000.0)
+
+   events = len([m for m in backend.messages if start <= m[0] <= start + run_time])
+   stats = seq.scheduler.telemetry.stats()
+   late_p99 = max([s["late"]["p99"] for s in stats["tracks"].values()] + [stats["clock"]["late"]["p99"]])
+   p50, p99, worst = percentiles(errors)
+   print("{:>5} {:>5} {:>8} {:>9.1f} {:>6.1f}% {:>8.3f} {:>8.3f} {:>8.3f} {:>8.3f} {:>9.3f} {:>9.3f} {:>8.3f} {:>7}".format(
+         bpm, bars, events, events / wall, (cpu / wall) * 100.0, p50, p99, worst, drift, late_p99,
+         stats["clock"]["period_error"]["p99"], percentiles(led)[1], stats["info"].get("mode", "-")))
+
+parser = argparse.ArgumentParser(description="Offline timing benchmark for the sequencer engine")
+parser.add_argument('--bpm', type=int, nargs='+', default=[90, 130, 180, 240])
+parser.add_argument('--bars', type=int, default=8)
+parser.add_argument('--tracks', type=int, default=8)
+parser.add_argument('--steps', type=int, default=32)
+parser.add_argument('--mash', type=float, default=0, help="Launchpad presses per second while playing")
+parser.add_argument('--performance', action='store_true', help="run the scheduler in performance mode")
+args = parser.parse_args()
+
+config = configparser.RawConfigParser()
+config.read('config.cfg')
+
+print("{:>5} {:>5} {:>8} {:>9} {:>7} {:>8} {:>8} {:>8} {:>8} {:>9} {:>9} {:>8} {:>7}".format(
+      "bpm", "bars", "events", "events/s", "cpu", "err p50", "err p99", "err max", "drift", "late p99", "clk p99",
+      "led p99", "mode"))
+print("{:>52}  (all times in ms)".format(""))
+for bpm in args.bpm:
+   run(config, bpm, args.bars, args.tracks, args.steps, args.mash, args.performance)
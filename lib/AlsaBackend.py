@@ -0,0 +1,72 @@
+import time
+
+try:
+   import alsa_midi
+except ImportError:
+   alsa_midi = None
+
+#
+# Output port on the ALSA sequencer with its own real time queue
+# The scheduler hands events over up to lookahead seconds before they are due, stamped with
+# their time, and the kernel sends them out on time however late Python wakes up afterwards
+#
+class AlsaOutput:
+
+   def __init__(self, client, port, queue, lookahead):
+      self.client = client
+      self.port = port
+      self.queue = queue
+      self.lookahead = lookahead
+      # perf_counter time of queue time zero, the scheduler's deadlines are on perf_counter
+      self.offset = time.perf_counter() - float(queue.get_status().real_time)
+
+   def send_message(self, msg):
+      self.sendBatch((msg,))
+
+   # Straight out, not through the queue
+   def sendBatch(self, msgs):
+      if(len(msgs) == 0): return
+      for msg in msgs: self.client.event_output(alsa_midi.MidiBytesEvent(msg), port=self.port)
+      self.client.drain_output()
+
+   def sendAt(self, when, msgs):
+      at = max(0.0, when - self.offset)
+      for msg in msgs: self.client.event_output(alsa_midi.MidiBytesEvent(msg, time=at), queue=self.queue, port=self.port)
+      self.client.drain_output()
+
+   # Forget everything handed over that the kernel hasn't sent yet
+   def cancel(self):
+      self.client.drop_output()
+
+   def close_port(self):
+      self.queue.stop()
+      self.client.drain_output()
+      self.client.close()
+
+#
+# Output only backend on the ALSA sequencer, for the notes and clock. Needs the alsa_midi module
+# Port numbers index the list from outputPorts(), which is not always rtmidi's order
+#
+class AlsaBackend:
+
+   def __init__(self, lookahead = 0.05, name = "LaunchPad Sequencer"):
+      if(alsa_midi == None): raise ImportError("the ALSA sequencer output needs the alsa_midi module")
+      self.lookahead = lookahead
+      self.name = name
+
+   def openOutput(self, port, urgent = False):
+      client = alsa_midi.SequencerClient(self.name)
+      dest = client.list_ports(output=True)[port]
+      src = client.create_port("out", caps=alsa_midi.READ_PORT)
+      src.connect_to(dest)
+      queue = client.create_queue()
+      queue.start()
+      client.drain_output()
+      return AlsaOutput(client, src, queue, self.lookahead)
+
+   def outputPorts(self):
+      if(alsa_midi == None): return []
+      client = alsa_midi.SequencerClient(self.name)
+      ports = [p.client_name + ":" + p.name for p in client.list_ports(output=True)]
+      client.close()
+      return ports
@@ -0,0 +1,82 @@
+import threading
+import heapq
+import itertools
+import time
+
+#
+# One worker thread for all LED animation on the Launchpad
+# Animations are just timed colour transitions in a heap, everything due at a wakeup
+# goes out as a single LaunchPad frame, so the thread count never depends on what is animating
+# Without threaded whoever sets notify is told of new work and calls applyDue itself
+#
+class Animator:
+
+   def __init__(self, pad, threaded = True):
+      self.pad = pad
+      self.heap = []
+      self.counter = itertools.count()
+      self.owner = {}           # (x, y) -> id of the newest animation on that cell
+      self.cond = threading.Condition()
+      self.notify = self.cond.notify
+
+      self.__quit_now = False
+      if(threaded): threading.Timer(0, self.__mainloop).start()
+
+   # Queue colour changes for one animation, a list of (delay, x, y, colour)
+   # A newer animation on the same cell replaces whatever is still pending from an older one
+   def add(self, transitions):
+      now = time.perf_counter()
+      with self.cond:
+         anim = next(self.counter)
+         for delay, x, y, c in transitions:
+            self.owner[(x, y)] = anim
+            heapq.heappush(self.heap, (now + delay, next(self.counter), anim, x, y, c))
+         self.notify()
+
+   def blink(self, x, y, c1, c2, t):
+      self.add([(0, x, y, c1), (t, x, y, c2)])
+
+   # Step through a list of colours spread evenly over t seconds
+   def fade(self, x, y, colours, t):
+      step_t = t / max(1, len(colours) - 1)
+      self.add([(i * step_t, x, y, c) for i, c in enumerate(colours)])
+
+   # Light each cell in turn for t seconds
+   def chase(self, cells, c_on, c_off, t):
+      trans = []
+      for i, (x, y) in enumerate(cells):
+         trans.append((i * t, x, y, c_on))
+         trans.append(((i + 1) * t, x, y, c_off))
+      self.add(trans)
+
+   def __mainloop(self):
+      while True:
+         with self.cond:
+            while not self.__quit_now and (len(self.heap) == 0 or self.heap[0][0] > time.perf_counter()):
+               timeout = None
+               if(len(self.heap) > 0): timeout = self.heap[0][0] - time.perf_counter()
+               self.cond.wait(timeout)
+            if(self.__quit_now): return
+         self.applyDue()
+
+   # Paint every transition that is due, returns when the next one is due or None
+   def applyDue(self):
+      with self.cond:
+         # pull every transition that is due, later ones for a cell win
+         due = {}
+         now = time.perf_counter()
+         while len(self.heap) > 0 and self.heap[0][0] <= now:
+            when, n, anim, x, y, c = heapq.heappop(self.heap)
+            if(self.owner.get((x, y)) != anim): continue
+            due[(x, y)] = c
+         upcoming = self.heap[0][0] if len(self.heap) > 0 else None
+
+      self.pad.beginFrame()
+      for (x, y), c in due.items(): self.pad.setCell(x, y, c)
+      self.pad.commit()
+      return upcoming
+
+   def quit(self):
+      with self.cond:
+         self.__quit_now = True
+         self.cond.notify()
@@ -0,0 +1,76 @@
+import asyncio
+import time
+import traceback
+
+TRANSPORT_POLL = 0.002  # how often a stopped external transport is looked at
+
+#
+# Event loop on perf_counter, the same clock the scheduler, animator and clock follower use
+#
+class PerfLoop(asyncio.SelectorEventLoop):
+
+   def time(self):
+      return time.perf_counter()
+
+#
+# Alternative to the threaded runtime, one asyncio loop runs the scheduler engine, the LED
+# animator, the playhead display and the Launchpad input handler with call_at deadlines, so
+# none of them ever run at the same time. Only the port writers (blocking USB writes), autosave and telemetry dump
+# stay on their own threads. The Launchpad and Sequencer must be built with threaded off
+# A test can pass in a loop with a virtual clock, the scheduler then runs on that clock
+#
+class AsyncRuntime:
+
+   def __init__(self, seq, loop = None):
+      self.seq = seq
+      self.pad = seq.pad
+      self.loop = loop if loop != None else PerfLoop()
+      self.scheduler = seq.scheduler
+      self.scheduler.now = self.loop.time
+      self.animation = None     # handle of the next animator wakeup
+
+      # both get called from the rtmidi thread or from handlers, hand the work to the loop
+      self.pad.notify = lambda: self.loop.call_soon_threadsafe(self.pad.processInput)
+      self.pad.animator.notify = lambda: self.loop.call_soon_threadsafe(self.__animate)
+
+   def run(self):
+      asyncio.set_event_loop(self.loop)
+      if(self.scheduler.realtime != None): self.scheduler.realtime.start()
+      self.loop.call_soon(self.__step)
+      self.loop.call_soon(self.__display)
+      try:
+         self.loop.run_forever()
+      finally:
+         if(self.scheduler.realtime != None): self.scheduler.realtime.stop()
+
+   # Run the engine up to its next wait, then come back at that deadline
+   # An engine that raised is finished, so the loop stops with it
+   def __step(self):
+      try:
+         deadline = next(self.scheduler.engine)
+      except StopIteration:
+         self.loop.stop()
+         return
+      except:
+         traceback.print_exc()
+         self.loop.stop()
+         return
+      if(deadline == None):
+         self.loop.call_later(TRANSPORT_POLL, self.__step)
+      else:
+         self.loop.call_at(deadline, self.__step)
+
+   # Playheads at the display's frame rate, for as long as the engine runs
+   # A frame that fails is only skipped, like on the Display's own thread
+   def __display(self):
+      try:
+         self.seq.display.refresh()
+      except:
+         traceback.print_exc()
+      self.loop.call_later(self.seq.display.interval, self.__display)
+
+   def __animate(self):
+      if(self.animation != None): self.animation.cancel()
+      self.animation = None
+      upcoming = self.pad.animator.applyDue()
+      if(upcoming != None): self.animation = self.loop.call_at(upcoming, self.__animate)
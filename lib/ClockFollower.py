@@ -0,0 +1,92 @@
+import threading
+from rtmidi.midiconstants import *
+
+PULSES_PER_BEAT = 24    # MIDI clock is always 24ppqn
+PLL_ALPHA = 0.15        # phase correction per pulse
+PLL_BETA = 0.0056       # period correction per pulse, about alpha^2/4 so the loop is near critically damped
+PLL_SEED = 6            # pulses timed straight after a (re)start, before the loop takes over
+PLL_LOST = 4.0          # an error this many periods out means the clock jumped, so start again
+
+#
+# Follows an external MIDI clock, the scheduler reads its tick deadlines from here instead of
+# the tempo map. Incoming pulses go through a second order phase locked loop, so the jitter of
+# the incoming clock is filtered out of the step timing. Start, Stop, Continue and Song Position
+# Pointer drive the transport
+#
+class ClockFollower:
+
+   def __init__(self, scheduler, backend, port, bpm):
+      self.scheduler = scheduler
+      self.ticks_per_pulse = (scheduler.clock_div * 6) / PULSES_PER_BEAT
+      self.pulse = -1
+      self.last_arrival = None
+      self.seed = (0, 0.0)      # (pulse, time) the loop was last started from
+      # phase is swapped as one tuple, (pulse, smoothed time of that pulse, period)
+      self.phase = (0, scheduler.now(), 60.0 / bpm / PULSES_PER_BEAT)
+      self.running = threading.Event()
+      self.armed = False        # Start or Continue seen, the transport runs from the next pulse
+      self.input = backend.openInput(port, self.__midi_message, True)
+      scheduler.follower = self
+
+   def bpm(self):
+      return 60.0 / (self.phase[2] * PULSES_PER_BEAT)
+
+   # Smoothed time of a scheduler tick, pulses past the last one received are predicted
+   def tickTime(self, tick):
+      pulse, at, period = self.phase
+      return at + (((tick / self.ticks_per_pulse) - pulse) * period)
+
+   def __midi_message(self, msg, data):
+      now = self.scheduler.now()
+      status = msg[0][0]
+      if(status == TIMING_CLOCK):
+         self.__clock(now)
+      elif(status == SONG_START):
+         self.running.clear()
+         self.pulse = -1
+         self.scheduler.locate(0)
+         self.armed = True
+      elif(status == SONG_CONTINUE):
+         self.armed = True
+      elif(status == SONG_STOP):
+         self.armed = False
+         self.running.clear()
+      elif(status == SONG_POSITION_POINTER):
+         # position is in 1/16th notes, six pulses each, and the next clock lands on it
+         position = (msg[0][2] << 7) | msg[0][1]
+         self.pulse = (position * 6) - 1
+         self.scheduler.locate(int(round(position * 6 * self.ticks_per_pulse)))
+
+   def __clock(self, now):
+      self.pulse += 1
+      pulse, at, period = self.phase
+      seed_pulse, seed_time = self.seed
+      if(self.last_arrival != None and self.pulse == pulse + 1 and self.pulse - seed_pulse <= PLL_SEED):
+         # just (re)started, the average interval so far beats a guess from the config bpm
+         self.phase = (self.pulse, now, (now - seed_time) / (self.pulse - seed_pulse))
+         self.last_arrival = now
+         self.__arm()
+         return
+      if(self.last_arrival != None and self.pulse == pulse + 1):
+         predicted = at + period
+         err = now - predicted
+         if(abs(err) < period * PLL_LOST):
+            self.scheduler.telemetry.recordInput(predicted, now)
+            self.phase = (self.pulse, predicted + (PLL_ALPHA * err), period + (PLL_BETA * err))
+            self.last_arrival = now
+            self.__arm()
+            return
+      # first pulse or after a jump
+      self.seed = (self.pulse, now)
+      self.phase = (self.pulse, now, period)
+      self.last_arrival = now
+      self.__arm()
+
+   def __arm(self):
+      if(not self.armed): return
+      self.armed = False
+      self.running.set()
+
+   def quit(self):
+      self.running.set()
+      self.input.close_port()
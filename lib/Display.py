@@ -0,0 +1,37 @@
+import threading
+import traceback
+from lib.LaunchPad import *
+
+#
+# Draws the playheads at a fixed frame rate, apart from the engine, so LED writes never sit on
+# the timing path and a step costs the engine nothing but a tuple. Each frame reads where every
+# track is, asks the sequencer which cells that lights in the current mode, and hands them to
+# the View as its overlay. The LaunchPad only sends cells that actually changed
+# Without threaded the driver calls refresh every interval itself
+#
+class Display:
+
+   def __init__(self, seq, rate = 30.0, threaded = True):
+      self.seq = seq
+      self.pad = seq.pad
+      self.interval = 1.0 / rate
+
+      self.__quit_now = threading.Event()
+      if(threaded): threading.Timer(0, self.__mainloop).start()
+
+   def refresh(self):
+      with self.pad.input_lock:
+         if(self.__quit_now.is_set()): return
+         self.seq.view.setOverlay(self.seq.playheadCells(self.seq.scheduler.playheads()))
+
+   def __mainloop(self):
+      while not self.__quit_now.wait(self.interval):
+         try:
+            self.refresh()
+         except:
+            traceback.print_exc()
+
+   # Once this returns no frame is being drawn and none will be
+   def quit(self):
+      self.__quit_now.set()
+      with self.pad.input_lock: pass
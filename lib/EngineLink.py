@@ -0,0 +1,183 @@
+import json
+import mmap
+import os
+import shutil
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import deque
+from lib.Session import *
+
+LINK_INTERVAL = 0.002      # how often the controller side publishes edits and launches
+RING_SIZE = 1024           # commands in flight, a power of two, the engine empties the ring every tick
+QUIT_WAIT = 5.0            # seconds the engine process gets to send its last note offs
+PLAYHEAD_TRIES = 8         # reads of a playhead caught mid write before the last good one is used
+
+MIRROR_FILE = 'mirror.bin'
+CONTROL_FILE = 'control.bin'
+
+CMD_PATTERN = 1            # a pattern's slot in the mirror was rewritten
+CMD_PLAY = 2               # queue a pattern on a track, pattern -1 stops it
+CMD_BPM = 3
+CMD_RAMP = 4
+CMD_QUIT = 5
+
+RECORD = struct.Struct('<BBhHHf')     # command, track, pattern, steps, quant, bpm
+
+#
+# Memory shared by the controller and engine processes, one mmap'd file holding the ring's
+# head and tail, the playhead of every track, a write counter for every pattern slot of the
+# mirror and then the command ring itself. Only EngineLink's thread moves the head and writes
+# slots, only the engine moves the tail and the playheads, so nothing needs a lock
+#
+class ControlBlock:
+
+   def size(num_tracks, num_patterns):
+      return 8 + (num_tracks * 16) + (num_tracks * num_patterns * 4) + (RING_SIZE * RECORD.size)
+
+   def create(path, num_tracks, num_patterns):
+      with open(path, 'wb') as f:
+         f.write(bytes(ControlBlock.size(num_tracks, num_patterns)))
+
+   def __init__(self, path, num_tracks, num_patterns):
+      with open(path, 'r+b') as f:
+         self.mm = mmap.mmap(f.fileno(), 0)
+      view = memoryview(self.mm)
+      playheads = 8 + (num_tracks * 16)
+      writes = playheads + (num_tracks * num_patterns * 4)
+      self.ring_pos = view[0:8].cast('I')                    # head, tail
+      self.playheads = view[8:playheads].cast('i')           # write counter, pattern (-1 for none), step offset, note
+      self.writes = view[playheads:writes].cast('I')         # odd while a slot is being rewritten
+      self.records = view[writes:]
+      self.views = [self.ring_pos, self.playheads, self.writes, self.records, view]
+
+   # Waits if the ring is full, which only happens if the engine has stopped
+   def push(self, cmd, track = 0, pattern = -1, steps = 0, quant = 0, bpm = 0.0):
+      head = self.ring_pos[0]
+      while ((head - self.ring_pos[1]) & 0xFFFFFFFF) >= RING_SIZE: time.sleep(LINK_INTERVAL)
+      RECORD.pack_into(self.records, (head % RING_SIZE) * RECORD.size, cmd, track, pattern, steps, quant, bpm)
+      # the head only moves once the record is in place
+      self.ring_pos[0] = (head + 1) & 0xFFFFFFFF
+
+   # Next command as (cmd, track, pattern, steps, quant, bpm), or None
+   def pop(self):
+      tail = self.ring_pos[1]
+      if(tail == self.ring_pos[0]): return None
+      record = RECORD.unpack_from(self.records, (tail % RING_SIZE) * RECORD.size)
+      self.ring_pos[1] = (tail + 1) & 0xFFFFFFFF
+      return record
+
+   def close(self):
+      for view in self.views: view.release()
+      self.mm.close()
+
+#
+# Controller side of runtime = process. The timing engine runs in its own process (EngineProcess)
+# which owns the MIDI output, clock and transport, so repaints, input handling and saves here
+# never hold the GIL it needs. Patterns are mirrored into a shared session format file, a thread
+# publishes every edit and pattern launch to it, the Display reads back the playheads
+# Stands in for the Scheduler as far as the Sequencer is concerned
+#
+class EngineLink:
+
+   def __init__(self, seq, conf):
+      self.seq = seq
+      self.tracks = seq.tracks
+      self.num_patterns = len(self.tracks[0].patterns)
+      self.base = tempfile.mkdtemp(prefix='lpseq', dir='/dev/shm' if os.path.isdir('/dev/shm') else None)
+
+      # the mirror starts out empty, everything gets published on the first pass
+      self.mirror = Session(os.path.join(self.base, MIRROR_FILE))
+      self.mirror.save(self.tracks)
+      with open(self.mirror.path, 'r+b') as f:
+         self.mm = mmap.mmap(f.fileno(), 0)
+      ControlBlock.create(os.path.join(self.base, CONTROL_FILE), len(self.tracks), self.num_patterns)
+      self.ctl = ControlBlock(os.path.join(self.base, CONTROL_FILE), len(self.tracks), self.num_patterns)
+      for t in range(len(self.tracks)): self.ctl.playheads[(t * 4) + 1] = -1
+      self.lit = [None] * len(self.tracks)               # last playhead read whole, per track
+      self.published = [{} for trk in self.tracks]       # pattern number -> version in the mirror
+      self.sent = [None] * len(self.tracks)              # pattern each track was last told to play
+      self.requests = deque()                            # tempo commands waiting for the link thread
+
+      root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+      self.process = subprocess.Popen([sys.executable, '-m', 'lib.EngineProcess', self.base,
+                                       json.dumps(dict(conf['global']))], cwd=root)
+      self.__quit_now = threading.Event()
+      self.thread = threading.Timer(0, self.__mainloop)
+      self.thread.start()
+
+   # Tempo changes come from the controller thread, the ring has one producer so they
+   # are only queued here and pushed by sync
+   def setBPM(self, bpm, quant = 0):
+      self.requests.append((CMD_BPM, 0, quant, bpm))
+
+   def rampBPM(self, bpm, steps, quant = 0):
+      self.requests.append((CMD_RAMP, steps, quant, bpm))
+
+   # Rewrite one slot of the mirror, the write counter lets the engine spot a slot read mid write
+   def publish(self, t, p):
+      i = (t * self.num_patterns) + p
+      offset = self.mirror.slotOffset(self.num_patterns, t, p)
+      slot = self.mirror.packPattern(self.tracks[t].patterns.peek(p))
+      self.ctl.writes[i] += 1
+      self.mm[offset : offset + len(slot)] = slot
+      self.ctl.writes[i] += 1
+      self.ctl.push(CMD_PATTERN, t, p)
+
+   # Edits go first, so a track is never told to play a pattern the engine hasn't got yet
+   def sync(self):
+      for t, trk in enumerate(self.tracks):
+         for p, pat in trk.patterns.items():
+            version = pat.version
+            if(self.published[t].get(p) == version): continue
+            self.publish(t, p)
+            self.published[t][p] = version
+      for t, trk in enumerate(self.tracks):
+         p = trk.active_pat
+         if(p == self.sent[t]): continue
+         self.ctl.push(CMD_PLAY, t, -1 if p == None else p)
+         self.sent[t] = p
+      while len(self.requests) > 0:
+         cmd, steps, quant, bpm = self.requests.popleft()
+         self.ctl.push(cmd, steps=steps, quant=quant, bpm=bpm)
+
+   # Same as Scheduler.playheads, as last reported by the engine process
+   # Like the pattern slots, an entry only counts if its write counter was even and unchanged
+   # across the read, one caught mid write keeps the last good value
+   def playheads(self):
+      heads = self.ctl.playheads
+      for t in range(len(self.tracks)):
+         i = t * 4
+         for n in range(PLAYHEAD_TRIES):
+            before = heads[i]
+            if(before & 1): continue
+            pattern, offset, note = heads[i + 1], heads[i + 2], heads[i + 3]
+            if(heads[i] != before): continue
+            self.lit[t] = (pattern, offset, note) if pattern >= 0 else None
+            break
+      return list(self.lit)
+
+   def __mainloop(self):
+      while not self.__quit_now.wait(LINK_INTERVAL):
+         if(self.process.poll() != None):
+            print("Engine process has exited")
+            return
+         self.sync()
+
+   # Waits for the engine process to send its last note offs, then removes the shared files
+   def quit(self):
+      self.__quit_now.set()
+      if(threading.current_thread() != self.thread): self.thread.join()
+      if(self.process.poll() == None):
+         self.ctl.push(CMD_QUIT)
+         try:
+            self.process.wait(QUIT_WAIT)
+         except subprocess.TimeoutExpired:
+            print("Engine process didn't quit, killing it")
+            self.process.kill()
+      self.ctl.close()
+      self.mm.close()
+      shutil.rmtree(self.base, ignore_errors=True)
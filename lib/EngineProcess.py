@@ -0,0 +1,104 @@
+import json
+import mmap
+import os
+import sys
+import time
+from array import array
+from lib.Sequencer import *
+from lib.EngineLink import *
+
+ENGINE_POLL = 0.002     # how often commands are looked at while the external transport is stopped
+
+#
+# Engine side of runtime = process, started by EngineLink as python -m lib.EngineProcess
+# Owns the MIDI output, the clock follower and a Scheduler with no thread of its own, which it
+# drives here, taking in the controller's commands between the engine's waits. The tracks here
+# only ever hold what the controller published to the mirror
+# Quits on CMD_QUIT, or when the controller process goes away
+#
+class EngineProcess:
+
+   def __init__(self, base, conf):
+      self.mirror = Session(os.path.join(base, MIRROR_FILE))
+      with open(self.mirror.path, 'r+b') as f:
+         self.mm = mmap.mmap(f.fileno(), 0)
+      magic, version, num_tracks, self.num_patterns, max_steps = HEADER.unpack_from(self.mm, 0)
+      self.ctl = ControlBlock(os.path.join(base, CONTROL_FILE), num_tracks, self.num_patterns)
+      self.parent = os.getppid()
+      self.shown = []             # playheads last written for the controller
+
+      self.tracks = [Track(self, t) for t in range(num_tracks)]
+      backend = WriterBackend(RtMidiBackend())
+      self.output = Sequencer.openOutput(conf, backend)
+      Sequencer.startEngine(self, conf, backend, False)
+
+   # Only take the slot if no rewrite started or finished while it was being read,
+   # a rewrite that did is followed by its own CMD_PATTERN
+   def readPattern(self, t, p):
+      i = (t * self.num_patterns) + p
+      before = self.ctl.writes[i]
+      if(before & 1): return
+      data = self.mirror.unpackPattern(self.mm, self.mirror.slotOffset(self.num_patterns, t, p))
+      if(self.ctl.writes[i] != before): return
+      trk = self.tracks[t]
+      trk.patterns[p].setData(data)
+      # compile it now rather than on the step that first plays it
+      if(p == trk.playing_pat or p == trk.active_pat): trk.eventTable(p, data)
+
+   # Returns False once the engine has been told to quit
+   def applyCommands(self):
+      if(os.getppid() != self.parent):
+         self.scheduler.quit()
+         return False
+      while True:
+         command = self.ctl.pop()
+         if(command == None): return True
+         cmd, t, p, steps, quant, bpm = command
+         if(cmd == CMD_PATTERN): self.readPattern(t, p)
+         if(cmd == CMD_PLAY):
+            if(p < 0): self.tracks[t].stopPlaying()
+            else: self.tracks[t].playPattern(p)
+         if(cmd == CMD_BPM): self.scheduler.setBPM(bpm, quant)
+         if(cmd == CMD_RAMP): self.scheduler.rampBPM(bpm, steps, quant)
+         if(cmd == CMD_QUIT):
+            self.scheduler.quit()
+            return False
+
+   def run(self):
+      realtime = self.scheduler.realtime
+      if(realtime != None): realtime.start()
+      for deadline in self.scheduler.engine:
+         if(not self.applyCommands()): continue
+         self.publishPlayheads()
+         if(deadline == None): time.sleep(ENGINE_POLL)
+         elif(realtime != None): realtime.sleepUntil(deadline)
+         else:
+            delay = deadline - self.scheduler.now()
+            if(delay > 0): time.sleep(delay)
+      if(realtime != None): realtime.stop()
+      self.quit()
+
+   # Only the tracks that moved, each entry's write counter is odd while it is being written
+   def publishPlayheads(self):
+      heads = self.scheduler.playheads()
+      if(heads == self.shown): return
+      for t, lit in enumerate(heads):
+         if(t < len(self.shown) and lit == self.shown[t]): continue
+         i = t * 4
+         self.ctl.playheads[i] += 1
+         if(lit == None): self.ctl.playheads[i + 1] = -1
+         else: self.ctl.playheads[i + 1 : i + 4] = array('i', lit)
+         self.ctl.playheads[i] += 1
+      self.shown = heads
+
+   def quit(self):
+      if(self.follower != None): self.follower.quit()
+      self.output.send_message([CONTROLLER_CHANGE, ALL_NOTES_OFF, 0])
+      self.output.send_message([CONTROLLER_CHANGE, 120, 0])
+      self.output.close_port()
+      self.ctl.close()
+      self.mm.close()
+
+
+if __name__ == '__main__':
+   EngineProcess(sys.argv[1], {'global': json.loads(sys.argv[2])}).run()
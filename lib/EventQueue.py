@@ -0,0 +1,31 @@
+import heapq
+import itertools
+
+#
+# Time ordered queue of pending MIDI messages, a binary heap so push & pop are O(log n)
+# however many notes are hanging. Only the scheduler thread touches it, so no locking
+#
+class EventQueue:
+
+   def __init__(self):
+      self.heap = []
+      self.counter = itertools.count()    # tie breaker, events at the same time keep push order
+
+   def __len__(self):
+      return len(self.heap)
+
+   def push(self, when, msg):
+      heapq.heappush(self.heap, (when, next(self.counter), msg))
+
+   def nextTime(self):
+      if(len(self.heap) == 0): return None
+      return self.heap[0][0]
+
+   def pop(self):
+      when, n, msg = heapq.heappop(self.heap)
+      return when, msg
+
+   def clear(self):
+      events = [(when, msg) for when, n, msg in sorted(self.heap)]
+      self.heap = []
+      return events
@@ -1,6 +1,11 @@
-import rtmidi
 from rtmidi.midiconstants import *
 import threading
+import time
+import traceback
+from collections import deque
+from lib.Animator import *
+from lib.MidiBackend import *
+from lib.PortWriter import *
 
 LED_OFF = 4
 RED_FULL = 7
@@ -16,30 +21,90 @@ AMBER_MID = ((RED_MID + GREEN_MID) - 4)
 AMBER_DIM = ((RED_DIM + GREEN_DIM) - 4)
 AMBER_BLINK = ((AMBER_FULL - 4) + 8)
 LONG_PRESS = 0.6
+TOP_ROW = 8             # frame row used for the round buttons along the top
+RAPID_UPDATE_MSGS = 40  # a rapid update repaints all 80 LEDs in this many messages
+
+# All 80 LEDs in the order the Launchpad rapid update walks them:
+# the grid top to bottom, then the side buttons, then the top buttons
+CELLS = [(x, y) for y in range(7, -1, -1) for x in range(8)] + \
+        [(8, y) for y in range(7, -1, -1)] + \
+        [(b, TOP_ROW) for b in range(8)]
 
 class LaunchPad:
 
-   def __init__(self, in_port, out_port):
+   def __init__(self, in_port, out_port, backend = None, threaded = True):
+      if(backend == None): backend = RtMidiBackend()
+      if(not isinstance(backend, WriterBackend)): backend = WriterBackend(backend)
       try:
-         self.input = rtmidi.MidiIn() 
-         self.output = rtmidi.MidiOut() 
-         self.input.open_port(in_port)
-         self.output.open_port(out_port)
-         self.input.set_callback(self.__midi_message)
          self.last_ts = 0
          self.btn_callback = None
          self.grid_callback = None
          self.btn_long_callback = None
          self.grid_long_callback = None
+         
+         # shadow of what the device is showing, [y][x], None until we know
+         self.shown = [[None] * 9 for y in range(9)]
+         self.frame_lock = threading.Lock()
+         self.local = threading.local()        # frames are built per thread
+         
+         # the rtmidi callback only timestamps and queues, the controller thread does the rest
+         # without threaded whoever sets notify has to call processInput
+         self.events = deque()                 # (arrival time, message)
+         self.pressed = {}                     # (type, num) -> arrival time of the press
+         self.wake = threading.Event()
+         self.input_lock = threading.RLock()   # held while input is handled, so nothing draws over a half done repaint
+         self.notify = self.wake.set
+         self.__quit_now = False
+         self.controller = None
+         if(threaded):
+            self.controller = threading.Thread(target=self.__controlLoop, daemon=True)
+            self.controller.start()
+         
+         self.output = backend.openOutput(out_port)
+         self.input = backend.openInput(in_port, self.__midi_message)
+         self.animator = Animator(self, threaded)
       except:
          print("Can't open Launchpad MIDI device, run 'cat /dev/sndstat' and check config file")
          exit()      
 
    def __midi_message(self, msg, ts):
-      type = msg[0][0]
-      num = msg[0][1]
-      val = msg[0][2]
-      time = msg[1]
+      self.events.append((time.perf_counter(), msg[0]))
+      self.notify()
+
+   def __controlLoop(self):
+      while not self.__quit_now:
+         self.wake.wait()
+         self.wake.clear()
+         self.processInput()
+
+   # Everything queued up meanwhile is handled in one frame, so repaints in between
+   # collapse and only the end result is sent
+   def processInput(self):
+      if(len(self.events) == 0): return
+      with self.input_lock:
+         self.beginFrame()
+         try:
+            while len(self.events) > 0:
+               arrival, msg = self.events.popleft()
+               try:
+                  self.__handle(arrival, msg)
+               except:
+                  traceback.print_exc()
+         finally:
+            self.commit()
+
+   # Press length comes from the arrival times, so a backlog never turns a tap into a long press
+   def __handle(self, arrival, msg):
+      type = msg[0]
+      num = msg[1]
+      val = msg[2]
+      if(val > 0):
+         self.pressed[(type, num)] = arrival
+         return
+      held = arrival - self.pressed.pop((type, num), arrival)
+      self.__dispatch(type, num, val, held)
+
+   def __dispatch(self, type, num, val, time):
       if(type == CONTROLLER_CHANGE and val == 0):       # Control change = top row of buttons
          if(time > LONG_PRESS):
             if(self.btn_long_callback != None): self.btn_long_callback(num - 104)
@@ -53,8 +118,53 @@ class LaunchPad:
             if(self.grid_callback != None): self.grid_callback(num)
 
             
+   # Start batching LED changes from this thread, frames can nest
+   def beginFrame(self):
+      if(getattr(self.local, 'depth', 0) == 0): self.local.pending = {}
+      self.local.depth = getattr(self.local, 'depth', 0) + 1
+
+   # Send what changed since the last flush, once the outermost frame is done
+   def commit(self):
+      self.local.depth -= 1
+      if(self.local.depth > 0): return
+      pending = self.local.pending
+      self.local.pending = {}
+      self.__flush(pending)
+
+   # Set any LED by frame position, buttons along the top are row TOP_ROW
+   def setCell(self, x, y, c):
+      if(getattr(self.local, 'depth', 0) > 0):
+         self.local.pending[(x, y)] = c
+      else:
+         self.__flush({(x, y): c})
+
+   def __flush(self, cells):
+      with self.frame_lock:
+         changed = [cell for cell in CELLS if cell in cells and cells[cell] != self.shown[cell[1]][cell[0]]]
+         for x, y in changed: self.shown[y][x] = cells[(x, y)]
+         if(len(changed) > RAPID_UPDATE_MSGS):
+            self.output.sendBatch(self.__rapidMessages())
+         else:
+            self.output.sendBatch([self.__cellMessage(x, y) for x, y in changed])
+
+   def __cellMessage(self, x, y):
+      c = self.shown[y][x]
+      if(y == TOP_ROW): return [CONTROLLER_CHANGE, 104 + x, c]
+      return [NOTE_ON, ((7 - y) * 16) + x, c]
+
+   def __rapidMessages(self):
+      # every LED gets sent, ones never set yet are sent off and shown as off from now on
+      for x, y in CELLS:
+         if(self.shown[y][x] == None): self.shown[y][x] = LED_OFF
+      # a normal message resets the rapid update cursor back to the first LED
+      msgs = [self.__cellMessage(*CELLS[0])]
+      colours = [self.shown[y][x] for x, y in CELLS]
+      for i in range(0, len(colours), 2):
+         msgs.append([NOTE_ON | 2, colours[i], colours[i + 1]])
+      return msgs
+
    def setButton(self, b, c):
-      self.output.send_message([CONTROLLER_CHANGE, 104 + b, c]) 
+      self.setCell(b, TOP_ROW, c)
 
    def convertToXY(note):
       x = (note % 16)
@@ -62,34 +172,46 @@ class LaunchPad:
       return x, y
    
    def close(self):
-      self.clear()
+      self.__quit_now = True
+      self.wake.set()
+      if(self.controller != None and threading.current_thread() != self.controller): self.controller.join()
+      self.animator.quit()
+      self.reset()
       self.input.close_port()
       self.output.close_port()
       
    def setLED(self, led_x, led_y, c):
       #print(" #LED# {},{},{}".format(led_x, led_y, c))
-      n = ((7 - led_y) * 16) + led_x
-      self.output.send_message([NOTE_ON, n, c]) 
+      self.setCell(led_x, led_y, c)
       
+   # Switch every LED off, only the ones that are lit get sent
    def clear(self):
-      self.output.send_message([CONTROLLER_CHANGE, 0, 0])
+      self.beginFrame()
+      for x, y in CELLS: self.setCell(x, y, LED_OFF)
+      self.commit()
+      
+   # Hard reset of the device, also drops flash mode
+   def reset(self):
+      with self.frame_lock:
+         self.output.send_message([CONTROLLER_CHANGE, 0, 0])
+         for x, y in CELLS: self.shown[y][x] = LED_OFF
       
    def blinkLED(self, bx, by, c1, c2, t):
-      self.setLED(bx, by, c1)
-      threading.Timer(t, self.setLED, [bx, by, c2]).start()
+      self.animator.blink(bx, by, c1, c2, t)
 
    def blinkButton(self, b, c1, c2, t):
-      self.setButton(b, c1)
-      threading.Timer(t, self.setButton, [b, c2]).start()
+      self.animator.blink(b, TOP_ROW, c1, c2, t)
       
    #def blinkLED_OFF(self, x, y, c1, c2, t):
    #   n = ((7 - y) * 16) + x
    #   #threading.Timer(t, self.__blinkLED_OFF).start()
       
    def clearGrid(self):
+      self.beginFrame()
       for y in range(8):
          for x in range(8):
             self.setLED(x, y, LED_OFF)
+      self.commit()
       
    def setFlash(self, on):
       if(on):
@@ -0,0 +1,93 @@
+import threading
+import time
+import rtmidi
+
+#
+# MIDI port backends, LaunchPad and Sequencer open their ports through one of these
+# Outputs need send_message() and close_port(), inputs call back with ([msg], delta_time) like rtmidi
+#
+class RtMidiBackend:
+
+   # timing lets clock and transport messages through, rtmidi drops them by default
+   def openInput(self, port, callback, timing = False):
+      midi_in = rtmidi.MidiIn()
+      midi_in.open_port(port)
+      if(timing): midi_in.ignore_types(timing=False)
+      midi_in.set_callback(callback)
+      return midi_in
+
+   def openOutput(self, port):
+      midi_out = rtmidi.MidiOut()
+      midi_out.open_port(port)
+      return midi_out
+
+   def outputPorts(self):
+      return rtmidi.MidiOut().get_ports()
+
+
+class RecordingOutput:
+
+   def __init__(self, backend, port):
+      self.backend = backend
+      self.port = port
+
+   def send_message(self, msg):
+      self.backend.messages.append((time.perf_counter(), self.port, list(msg)))
+
+   def close_port(self):
+      pass
+
+
+class RecordingInput:
+
+   def __init__(self, callback):
+      self.callback = callback
+      self.last = None
+      self.received = []        # (perf_counter time, msg) of everything delivered
+
+   # Deliver one message the way rtmidi would, with the time since the last one
+   def receive(self, msg):
+      now = time.perf_counter()
+      delta = 0.0 if self.last == None else now - self.last
+      self.last = now
+      self.received.append((now, list(msg)))
+      self.callback((list(msg), delta), None)
+
+   def close_port(self):
+      pass
+
+#
+# In process backend for running without hardware, every outbound message is kept
+# with its send time and scripted input can be played into any opened input port
+#
+class RecordingBackend:
+
+   def __init__(self):
+      self.messages = []        # (perf_counter time, port, msg)
+      self.inputs = {}          # port -> RecordingInput
+
+   def openInput(self, port, callback, timing = False):
+      self.inputs[port] = RecordingInput(callback)
+      return self.inputs[port]
+
+   def openOutput(self, port):
+      return RecordingOutput(self, port)
+
+   def outputPorts(self):
+      return ["Recording " + str(p) for p in range(4)]
+
+   def sent(self, port = None):
+      return [(t, msg) for t, p, msg in list(self.messages) if port == None or p == port]
+
+   # Play a script of (delay in secs from start, msg) into an input, in its own thread
+   # Press and release pairs give the press duration, so long presses can be scripted too
+   def playInput(self, port, script):
+      def play():
+         start = time.perf_counter()
+         for delay, msg in script:
+            wait = (start + delay) - time.perf_counter()
+            if(wait > 0): time.sleep(wait)
+            self.inputs[port].receive(msg)
+      player = threading.Thread(target=play)
+      player.start()
+      return player
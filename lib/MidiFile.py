@@ -0,0 +1,56 @@
+import struct
+
+#
+# Minimal Standard MIDI File writer, format 1 with one MTrk chunk per track
+#
+
+# Variable length quantity, 7 bits per byte, top bit set on all but the last
+def varLen(n):
+   out = [n & 0x7F]
+   n >>= 7
+   while n > 0:
+      out.insert(0, (n & 0x7F) | 0x80)
+      n >>= 7
+   return bytes(out)
+
+
+class MidiTrack:
+
+   def __init__(self, name = None):
+      self.events = []          # (absolute tick, bytes), kept in the order added for equal ticks
+      if(name != None): self.addMeta(0, 0x03, name.encode('ascii', 'replace'))
+
+   def add(self, tick, msg):
+      self.events.append((tick, bytes(msg)))
+
+   def addMeta(self, tick, meta_type, data):
+      self.events.append((tick, bytes([0xFF, meta_type]) + varLen(len(data)) + data))
+
+   def addTempo(self, tick, bpm):
+      self.addMeta(tick, 0x51, struct.pack('>I', int(round(60000000.0 / bpm)))[1:])
+
+   def chunk(self):
+      body = bytearray()
+      last = 0
+      for tick, data in sorted(self.events, key=lambda e: e[0]):
+         body += varLen(tick - last) + data
+         last = tick
+      body += varLen(0) + bytes([0xFF, 0x2F, 0x00])
+      return b'MTrk' + struct.pack('>I', len(body)) + bytes(body)
+
+
+class MidiFile:
+
+   def __init__(self, ppqn):
+      self.ppqn = ppqn
+      self.tracks = []
+
+   def addTrack(self, name = None):
+      trk = MidiTrack(name)
+      self.tracks.append(trk)
+      return trk
+
+   def write(self, path):
+      with open(path, 'wb') as f:
+         f.write(b'MThd' + struct.pack('>IHHH', 6, 1, len(self.tracks), self.ppqn))
+         for trk in self.tracks: f.write(trk.chunk())
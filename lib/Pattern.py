@@ -0,0 +1,232 @@
+from array import array
+import threading
+
+PAGE_LEN = 8
+DEFAULT_NOTE = 0
+DEFAULT_VEL = 127
+DEFAULT_GATE = 0.9
+
+#
+# One published version of a pattern's steps, held as parallel typed array columns
+# A snapshot is never changed once it is published, edits copy it and swap in the copy
+#
+class PatternData:
+   __slots__ = ('notes', 'vels', 'gates', 'ratchets', 'actives')
+
+   def __init__(self, notes, vels, gates, ratchets, actives):
+      self.notes = notes
+      self.vels = vels
+      self.gates = gates
+      self.ratchets = ratchets
+      self.actives = actives
+
+   def __len__(self):
+      return len(self.notes)
+
+   def blank(length):
+      return PatternData(array('B', [DEFAULT_NOTE] * length), array('B', [DEFAULT_VEL] * length),
+                         array('f', [DEFAULT_GATE] * length), array('B', [1] * length), array('B', [1] * length))
+
+   def copy(self):
+      return PatternData(array('B', self.notes), array('B', self.vels), array('f', self.gates),
+                         array('B', self.ratchets), array('B', self.actives))
+
+   def resized(self, length):
+      data = self.copy()
+      if(length < len(data)):
+         for col in PatternData.__slots__: del getattr(data, col)[length:]
+      else:
+         extra = PatternData.blank(length - len(data))
+         for col in PatternData.__slots__: getattr(data, col).extend(getattr(extra, col))
+      return data
+
+# Snapshots are never changed, so every unused pattern can share this one
+EMPTY = PatternData.blank(PAGE_LEN)
+
+#
+# Pattern edits are copy on write, the player picks up self.data once per step
+# and so never needs a lock and never sees a half edited or half resized pattern
+#
+class Pattern:
+   def __init__(self):
+      self.empty = True
+      self.active = False
+      #self.editing = False
+      self.__data = EMPTY
+      self.raw = None                       # loader for saved columns, not unpacked until needed
+      self.steps = StepList(self)
+      self.note_count = 0
+      self.edit_lock = threading.RLock()    # only serialises writers with each other
+      self.version = 0                      # bumped on every edit, lets autosave spot dirty patterns
+
+   # Current snapshot, saved patterns are unpacked on first use
+   @property
+   def data(self):
+      if(self.raw != None): self.materialise()
+      return self.__data
+
+   @data.setter
+   def data(self, data):
+      self.__data = data
+      self.raw = None
+
+   # Unpack saved columns now, playPattern calls this so the player never has to
+   def materialise(self):
+      with self.edit_lock:
+         if(self.raw == None): return
+         self.__data = self.raw()
+         self.raw = None
+
+   # Keep a saved pattern packed until it is played or edited, raw() must return a PatternData
+   def setRaw(self, raw, note_count):
+      with self.edit_lock:
+         self.__data = EMPTY
+         self.raw = raw
+         self.version += 1
+      self.note_count = note_count
+
+   # Change one field of one step, col is a PatternData column name
+   def setField(self, col, i, v):
+      with self.edit_lock:
+         data = self.data.copy()
+         getattr(data, col)[i] = v
+         self.data = data
+         self.version += 1
+
+   # Publish a whole new snapshot, e.g. when loading
+   def setData(self, data):
+      with self.edit_lock:
+         self.data = data
+         self.version += 1
+      self.note_count = len(data) - data.notes.count(0)
+
+   def addPage(self):
+      with self.edit_lock:
+         self.data = self.data.resized(len(self.data) + PAGE_LEN)
+         self.version += 1
+
+   #def editPattern(self):
+   #   self.editing = True
+
+   #def editPatternStop(self):
+   #   self.editing = False
+
+   def removePage(self):
+      with self.edit_lock:
+         self.data = self.data.resized(len(self.data) - PAGE_LEN)
+         self.version += 1
+
+   def countPages(self):
+      #print("len="+str(len(self.steps)))
+      return int(len(self.data) / PAGE_LEN)
+
+   def isEmpty(self):
+      return self.note_count <= 0
+
+   def delete(self):
+      self.empty = True
+      self.active = False
+      with self.edit_lock:
+         self.data = EMPTY
+         self.version += 1
+      self.note_count = 0
+
+   # Fill from saved step dicts, list MUST still be 8, 16, 24 or 32 long
+   def loadSteps(self, steps):
+      self.setData(PatternData(array('B', [s['note'] for s in steps]), array('B', [s['vel'] for s in steps]),
+                               array('f', [s['gate'] for s in steps]), array('B', [s.get('ratchet', 1) for s in steps]),
+                               array('B', [s.get('active', True) for s in steps])))
+
+   def saveSteps(self):
+      data = self.data
+      return [{"note": data.notes[i], "gate": round(data.gates[i], 4), "vel": data.vels[i],
+               "active": bool(data.actives[i]), "ratchet": data.ratchets[i]} for i in range(len(data))]
+
+
+#
+# A track's patterns, each one only created when first asked for, so a big bank of unused
+# patterns costs nothing. Anything that walks the whole bank should use isEmpty and items
+# rather than indexing every slot
+#
+class PatternBank:
+
+   def __init__(self, size):
+      self.size = size
+      self.made = {}            # pattern number -> Pattern
+
+   def __len__(self):
+      return self.size
+
+   def __getitem__(self, p):
+      pat = self.made.get(p)
+      if(pat != None): return pat
+      if(p < 0 or p >= self.size): raise IndexError("pattern index out of range")
+      return self.made.setdefault(p, Pattern())
+
+   # None if the pattern was never created
+   def peek(self, p):
+      return self.made.get(p)
+
+   def isEmpty(self, p):
+      pat = self.made.get(p)
+      return pat == None or pat.isEmpty()
+
+   # (number, pattern) for every pattern created so far, in order
+   def items(self):
+      return sorted(list(self.made.items()), key=lambda item: item[0])
+
+
+#
+# Sequence of step views, so pattern.steps[n].note still reads and writes like it always did
+#
+class StepList:
+   __slots__ = ('pat',)
+
+   def __init__(self, pat):
+      self.pat = pat
+
+   def __len__(self):
+      return len(self.pat.data)
+
+   def __getitem__(self, i):
+      if(i < 0): i += len(self.pat.data)
+      if(i < 0 or i >= len(self.pat.data)): raise IndexError("step index out of range")
+      return Step(self.pat, i)
+
+   def __iter__(self):
+      for i in range(len(self.pat.data)): yield Step(self.pat, i)
+
+
+class Step:
+   __slots__ = ('pat', 'i')
+
+   def __init__(self, pat, i):
+      self.pat = pat
+      self.i = i
+
+   @property
+   def note(self): return self.pat.data.notes[self.i]
+   @note.setter
+   def note(self, n): self.pat.setField('notes', self.i, n)
+
+   @property
+   def vel(self): return self.pat.data.vels[self.i]
+   @vel.setter
+   def vel(self, v): self.pat.setField('vels', self.i, v)
+
+   # fraction of the step, over 1.0 ties into the next steps
+   @property
+   def gate(self): return self.pat.data.gates[self.i]
+   @gate.setter
+   def gate(self, g): self.pat.setField('gates', self.i, g)
+
+   # number of repeats squeezed into the step
+   @property
+   def ratchet(self): return self.pat.data.ratchets[self.i]
+   @ratchet.setter
+   def ratchet(self, r): self.pat.setField('ratchets', self.i, r)
+
+   @property
+   def active(self): return bool(self.pat.data.actives[self.i])
+   @active.setter
+   def active(self, a): self.pat.setField('actives', self.i, int(a))
@@ -0,0 +1,103 @@
+import threading
+import time
+from collections import deque
+
+#
+# One writer thread per MIDI output port, so a slow USB write on one device (usually the
+# Launchpad) never holds up the scheduler or another port. Items are lists of messages,
+# everything due on one tick goes in as one item and is written back to back in one wakeup
+# An item can carry the time it was due and a Telemetry, which then gets the time it really went out
+# deque append and popleft are atomic, the only lock is in the wakeup event
+#
+class PortWriter:
+
+   def __init__(self, port):
+      self.port = port
+      self.urgent = deque()     # notes and clock, always written first
+      self.normal = deque()     # LEDs and the rest
+      self.wake = threading.Event()
+      self.users = 0
+
+      self.__quit_now = False
+      self.thread = threading.Thread(target=self.__mainloop, daemon=True)
+      self.thread.start()
+
+   def put(self, msgs, urgent, when = None, telemetry = None):
+      (self.urgent if urgent else self.normal).append((msgs, when, telemetry))
+      self.wake.set()
+
+   def __mainloop(self):
+      while True:
+         self.wake.wait()
+         self.wake.clear()
+         while len(self.urgent) > 0 or len(self.normal) > 0:
+            while len(self.urgent) > 0: self.__write(self.urgent.popleft())
+            # one normal item at a time, so urgent ones queued meanwhile go next
+            if(len(self.normal) > 0): self.__write(self.normal.popleft())
+         if(self.__quit_now): break
+      self.port.close_port()
+
+   def __write(self, item):
+      msgs, when, telemetry = item
+      try:
+         for msg in msgs: self.port.send_message(msg)
+      except:
+         print("MIDI write failed")
+         return
+      if(telemetry != None): telemetry.recordBatch(msgs, when, time.perf_counter())
+
+   # Writes whatever is queued, then closes the port once its last user has gone
+   def close(self):
+      self.users -= 1
+      if(self.users > 0): return
+      self.__quit_now = True
+      self.wake.set()
+      if(threading.current_thread() != self.thread): self.thread.join()
+
+
+#
+# What LaunchPad and Sequencer see as their output, the same calls as an rtmidi port
+#
+class PortOutput:
+
+   def __init__(self, writer, urgent):
+      self.writer = writer
+      self.urgent = urgent
+
+   def send_message(self, msg):
+      self.writer.put((msg,), self.urgent)
+
+   def sendBatch(self, msgs):
+      if(len(msgs) > 0): self.writer.put(msgs, self.urgent)
+
+   # Same, the writer thread records the batch against when once it is actually written
+   def sendTimed(self, when, msgs, telemetry):
+      if(len(msgs) > 0): self.writer.put(msgs, self.urgent, when, telemetry)
+
+   def close_port(self):
+      self.writer.close()
+
+
+#
+# Wraps another backend so every output port gets a writer thread, opening the same port
+# twice shares its writer, with urgent outputs jumping the queue of the others
+#
+class WriterBackend:
+
+   def __init__(self, backend):
+      self.backend = backend
+      self.writers = {}         # port -> PortWriter
+
+   def openInput(self, port, callback, timing = False):
+      return self.backend.openInput(port, callback, timing)
+
+   def openOutput(self, port, urgent = False):
+      writer = self.writers.get(port)
+      if(writer == None or writer.users == 0):
+         writer = PortWriter(self.backend.openOutput(port))
+         self.writers[port] = writer
+      writer.users += 1
+      return PortOutput(writer, urgent)
+
+   def outputPorts(self):
+      return self.backend.outputPorts()
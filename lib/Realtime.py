@@ -0,0 +1,70 @@
+import gc
+import os
+import time
+import threading
+
+NICE = -10              # niceness asked for when SCHED_FIFO is not allowed
+GC_GAP = 0.004          # only collect when the next deadline is at least this far off
+GC_FULL_GAP = 0.012     # and this far off for the oldest generation, which takes longest
+
+#
+# Performance mode for the scheduler thread, all opt in from config.cfg
+# The thread asks for SCHED_FIFO (or a lower niceness), the cyclic GC is frozen and only
+# run by hand in the gaps between ticks, and waits sleep until spin seconds before the
+# deadline then busy wait the rest, so a late wakeup from the OS doesn't land on a note
+# Automatic GC is off for the whole process while it runs, not just this thread, so all the
+# collecting there is happens in idle
+#
+class Realtime:
+
+   def __init__(self, priority = 50, spin = 0.001):
+      self.priority = priority
+      self.spin = spin
+      self.telemetry = None     # set by the scheduler, the mode and gc passes are shown with its numbers
+      self.mode = "normal"
+      self.gc_passes = 0
+
+   # Called from the scheduler thread itself, pid 0 is the calling thread on Linux
+   def start(self):
+      try:
+         os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(self.priority))
+         self.mode = "fifo"
+      except (AttributeError, OSError):
+         try:
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), NICE)
+            self.mode = "nice"
+         except (AttributeError, OSError):
+            self.mode = "normal"
+
+      # everything loaded so far is moved out of the GC's sight, what's left is only new garbage
+      gc.collect()
+      gc.freeze()
+      gc.disable()
+      self.report()
+
+   def stop(self):
+      gc.unfreeze()
+      gc.enable()
+
+   def sleepUntil(self, deadline):
+      delay = deadline - time.perf_counter() - self.spin
+      if(delay > 0): time.sleep(delay)
+      while time.perf_counter() < deadline: pass
+
+   # Collect what the GC would have when there is time to spare before the next deadline,
+   # the young generations in any gap, the oldest only in a long one
+   def idle(self, deadline):
+      gap = deadline - time.perf_counter()
+      if(gap < GC_GAP): return
+      counts = gc.get_count()
+      thresholds = gc.get_threshold()
+      if(counts[0] < thresholds[0]): return
+      generation = 0
+      if(counts[1] >= thresholds[1]): generation = 1
+      if(counts[2] >= thresholds[2] and gap >= GC_FULL_GAP): generation = 2
+      gc.collect(generation)
+      self.gc_passes += 1
+      self.report()
+
+   def report(self):
+      if(self.telemetry != None): self.telemetry.info = {"mode": self.mode, "gc passes": self.gc_passes}
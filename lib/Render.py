@@ -0,0 +1,76 @@
+from rtmidi.midiconstants import *
+from lib.MidiFile import *
+
+PPQN = 96
+BAR_TICKS = PPQN * 4
+
+#
+# Offline renderer, walks the same pattern snapshots the scheduler plays but on a
+# virtual tick clock with no sleeping, and writes the result as a Standard MIDI File
+# A scene is (list of pattern numbers per track, None for silent, length in bars)
+#
+class Renderer:
+
+   def __init__(self, tracks, bpm):
+      self.tracks = tracks
+      self.bpm = bpm
+
+   # Every session row with something in it becomes a scene, as long as its longest pattern
+   def sessionScenes(self):
+      scenes = []
+      for p in range(len(self.tracks[0].patterns)):
+         row = [p if not trk.patterns.isEmpty(p) else None for trk in self.tracks]
+         if(all(r == None for r in row)): continue
+         steps = max(len(trk.patterns[p].data) for trk in self.tracks if not trk.patterns.isEmpty(p))
+         scenes.append((row, max(1, int((steps + 15) / 16))))
+      return scenes
+
+   # Absolute (tick, order, msg) events for one track, note offs sort before note ons on the same tick
+   def trackEvents(self, trk, t, scenes):
+      events = []
+      step_ticks = PPQN / trk.timediv
+      scene_start = 0
+      for row, bars in scenes:
+         scene_ticks = bars * BAR_TICKS
+         if(row[t] != None):
+            data = trk.patterns[row[t]].data
+            k = 0
+            while k * step_ticks < scene_ticks:
+               offset = k % len(data)
+               note = data.notes[offset]
+               if(note > 0 and data.actives[offset]):
+                  # same ratchet and tie rules as the scheduler
+                  ratchet = data.ratchets[offset]
+                  hit_ticks = step_ticks / ratchet
+                  for r in range(ratchet):
+                     on = scene_start + (k * step_ticks) + (r * hit_ticks)
+                     on_tick = int(round(on))
+                     off_tick = max(on_tick + 1, int(round(on + (data.gates[offset] * hit_ticks))))
+                     events.append((on_tick, 1, [trk.channel | NOTE_ON, note, data.vels[offset]]))
+                     events.append((off_tick, 0, [trk.channel | NOTE_OFF, note, 0]))
+               k += 1
+         scene_start += scene_ticks
+      events.sort(key=lambda e: (e[0], e[1]))
+      return events
+
+   def render(self, path, scenes = None):
+      if(scenes == None): scenes = self.sessionScenes()
+      smf = MidiFile(PPQN)
+      conductor = smf.addTrack("Tempo")
+      conductor.addTempo(0, self.bpm)
+
+      for t, trk in enumerate(self.tracks):
+         events = self.trackEvents(trk, t, scenes)
+         if(len(events) == 0): continue
+         mtrk = smf.addTrack("Track " + str(t + 1))
+         sounding = {}
+         for tick, order, msg in events:
+            # overlapping voices of one note only release on the last note off
+            if(order == 1):
+               sounding[msg[1]] = sounding.get(msg[1], 0) + 1
+            else:
+               sounding[msg[1]] -= 1
+               if(sounding[msg[1]] > 0): continue
+            mtrk.add(tick, msg)
+      smf.write(path)
+      return sum(bars for row, bars in scenes) * 4 * 60.0 / self.bpm
@@ -0,0 +1,214 @@
+import time
+import threading
+from rtmidi.midiconstants import *
+from lib.EventQueue import *
+from lib.Telemetry import *
+from lib.TempoMap import *
+from lib.Realtime import *
+
+CLOCKS_PER_BEAT = 6     # MIDI clock pulses per clock_div beat (24ppqn with a clock_div of 4)
+LAUNCH_QUANTS = [1, 4, 8, 16]   # allowed launch quantisation, in 1/16th steps
+CLOCK_MSG = bytes([TIMING_CLOCK])
+
+#
+# Single master timeline for the whole sequencer
+# Every tick is one MIDI clock pulse, its deadline is worked out from a shared epoch and
+# the tempo map, so sleeping late on one tick never pushes the following ticks back (no drift)
+# The engine itself is a generator yielding the times it has to wait for, a thread drives it
+# by sleeping, or with threaded off something else does (AsyncRuntime, or a test on a virtual clock)
+#
+class Scheduler:
+
+   def __init__(self, seq, bpm, clock_div, launch_quant = 16, realtime = None, threaded = True):
+      self.seq = seq
+      self.clock_div = clock_div
+      self.step_ticks = max(1, int(round(clock_div * CLOCKS_PER_BEAT / 4.0)))    # ticks in a 1/16th
+      self.setLaunchQuant(launch_quant)
+      self.tick = 0
+      self.now = time.perf_counter     # clock every deadline is on, a driver can swap it
+      self.epoch = self.now()
+      self.tempo = TempoMap(bpm, clock_div * CLOCKS_PER_BEAT)
+      self.events = EventQueue()   # pending note ons (ratchets) and note offs
+      self.sounding = {}           # (channel, note) -> number of overlapping voices
+      self.lit = {}                # track -> (pattern, offset, note) of the step it is on, for the Display
+      self.telemetry = Telemetry()
+      self.realtime = realtime     # Realtime when performance mode is on
+      if(realtime != None): realtime.telemetry = self.telemetry
+      self.follower = None         # ClockFollower when slaved to an external clock
+      self.lookahead = 0.0         # seconds early events go to an output that sends them on time itself
+      self.timed = False           # output has sendTimed, its writer records when batches really went out
+      self.__locate = None         # tick to jump to, asked for from another thread
+
+      self.__quit_now = False
+      self.engine = self.__run()
+      self.thread = None
+      if(threaded):
+         self.thread = threading.Timer(0, self.__mainloop)
+         self.thread.start()
+
+   def tickTime(self, tick):
+      if(self.follower != None): return self.follower.tickTime(tick)
+      return self.epoch + self.tempo.time(tick)
+
+   def ticksPerStep(self, trk):
+      return max(1, int(round(self.clock_div * CLOCKS_PER_BEAT / trk.timediv)))
+
+   # Pattern launches wait for the next boundary of this many 1/16th steps on the master tick
+   def setLaunchQuant(self, quant):
+      if(quant not in LAUNCH_QUANTS): quant = LAUNCH_QUANTS[-1]
+      self.launch_quant = quant
+      self.launch_ticks = quant * self.step_ticks
+
+   # First tick on a boundary of quant 1/16th steps, 0 means the very next tick
+   def quantTick(self, quant):
+      tick = self.tick + 1
+      if(quant <= 0): return tick
+      quant_ticks = quant * self.step_ticks
+      return ((tick + quant_ticks - 1) // quant_ticks) * quant_ticks
+
+   # Tempo changes go in the tempo map from a future tick, so what has been played never moves
+   def setBPM(self, bpm, quant = 0):
+      self.tempo.setBPM(bpm, self.tick, self.quantTick(quant))
+
+   # Linear ramp to bpm over a number of 1/16th steps
+   def rampBPM(self, bpm, steps, quant = 0):
+      self.tempo.ramp(bpm, self.tick, self.quantTick(quant), steps * self.step_ticks)
+
+   # Jump the transport, done by the scheduler thread at the top of its next tick
+   def locate(self, tick):
+      self.__locate = tick
+
+   def __doLocate(self):
+      tick, self.__locate = self.__locate, None
+      self.__allOff()
+      self.tick = tick
+      for trk in self.seq.tracks:
+         trk.playing_pat = trk.active_pat
+         if(trk.playing_pat == None): continue
+         data = trk.patterns[trk.playing_pat].data
+         trk.position = (tick // self.ticksPerStep(trk)) % len(data)
+
+   def __allOff(self):
+      pending = [msg for when, msg in self.events.clear() if msg[0] & 0xF0 == NOTE_OFF]
+      if(self.lookahead > 0):
+         # the output may still hold note offs it was handed early, drop the lot and stop every voice now
+         self.seq.output.cancel()
+         pending = [bytes([NOTE_OFF | channel, note, 0]) for channel, note in self.sounding]
+      self.seq.output.sendBatch(pending)
+      self.sounding = {}
+
+   # With a lookahead the batch goes out stamped with its time, the output sends it when due
+   # A port writer records the batch in the telemetry once written, otherwise it counts as sent here
+   def __hand(self, when, batch):
+      if(len(batch) == 0): return
+      if(self.lookahead > 0): self.seq.output.sendAt(when, batch)
+      elif(self.timed):
+         self.seq.output.sendTimed(when, batch, self.telemetry)
+         return
+      else: self.seq.output.sendBatch(batch)
+      self.telemetry.recordBatch(batch, when, self.now())
+
+   def __sleepUntil(self, deadline):
+      if(self.realtime != None): return self.realtime.sleepUntil(deadline)
+      delay = deadline - self.now()
+      if(delay > 0): time.sleep(delay)
+
+   # Voice counting, overlapping voices of one note (tied gates) only release on the last note off
+   def __sounds(self, msg):
+      key = (msg[0] & 0x0F, msg[1])
+      if(msg[0] & 0xF0 == NOTE_ON):
+         self.sounding[key] = self.sounding.get(key, 0) + 1
+         return True
+      count = self.sounding.get(key, 0) - 1
+      if(count > 0):
+         self.sounding[key] = count
+         return False
+      self.sounding.pop(key, None)
+      return True
+
+   # Send everything in the queue due up to the given time, one wakeup and one batch per
+   # distinct time, lead goes at the front of the first batch (the clock for this tick)
+   # With a lookahead the telemetry shows how early each batch was handed over, as negative lateness
+   def __dispatch(self, until, lead = None):
+      batch = lead or []
+      while len(self.events) > 0 and self.events.nextTime() <= until:
+         when = self.events.nextTime()
+         if(when - self.lookahead > self.now()): yield when - self.lookahead
+         while len(self.events) > 0 and self.events.nextTime() <= when:
+            msg = self.events.pop()[1]
+            if(self.__sounds(msg)): batch.append(msg)
+         self.__hand(when, batch)
+         batch = []
+      self.__hand(until, batch)
+
+   # The engine, yields each time it has to wait until, or None while the external transport is stopped
+   def __run(self):
+      self.epoch = self.now()
+      try:
+         while not self.__quit_now:
+            if(self.__locate != None): self.__doLocate()
+            if(self.follower != None and not self.follower.running.is_set()):
+               # external transport stopped, nothing sounds until Continue or Start
+               self.__allOff()
+               yield None
+               continue
+            deadline = self.tickTime(self.tick)
+            yield from self.__dispatch(deadline)
+
+            if(deadline - self.lookahead > self.now()): yield deadline - self.lookahead
+            if(self.tick % self.launch_ticks == 0):
+               for trk in self.seq.tracks: trk.launch()
+            for trk in self.seq.tracks:
+               # idle tracks cost one check a tick
+               if(trk.playing_pat == None and trk not in self.lit): continue
+               step_ticks = self.ticksPerStep(trk)
+               if(self.tick % step_ticks == 0): self.__playStep(trk, deadline, step_ticks)
+            # the clock and the notes starting on this tick go to the port writer together
+            yield from self.__dispatch(deadline, [CLOCK_MSG])
+            self.tick += 1
+            if(self.realtime != None):
+               upcoming = self.tickTime(self.tick)
+               if(len(self.events) > 0): upcoming = min(upcoming, self.events.nextTime())
+               self.realtime.idle(upcoming - self.lookahead)
+      finally:
+         # don't leave anything hanging on the way out, also when the driver closes the engine
+         self.__allOff()
+
+   def __mainloop(self):
+      if(self.realtime != None): self.realtime.start()
+      for deadline in self.engine:
+         if(deadline == None): self.follower.running.wait(0.1)
+         else: self.__sleepUntil(deadline)
+      if(self.realtime != None): self.realtime.stop()
+
+   def __playStep(self, trk, deadline, step_ticks):
+      next_step = trk.nextStep()
+      if(next_step == None):
+         self.lit.pop(trk, None)
+         return
+      offset, data = next_step
+      note = data.notes[offset]
+      # no LEDs from here, the Display reads this at its own frame rate
+      self.lit[trk] = (trk.playing_pat, offset, note)
+      hits = trk.eventTable(trk.playing_pat, data)[offset]
+      if(hits == None): return
+
+      #print("##NOTE## {}:{} ({})".format(trk.channel, note, offset))
+      # every voice overlaps freely, the note offs are voice counted in __sounds
+      step_time = self.tickTime(self.tick + step_ticks) - deadline
+      for start, length, on, off in hits:
+         when = deadline + (start * step_time)
+         self.events.push(when, on)
+         self.events.push(when + (length * step_time), off)
+
+   # Where every track is, (pattern, step offset, note) or None when stopped
+   def playheads(self):
+      return [self.lit.get(trk) for trk in self.seq.tracks]
+
+   # Waits for the last note offs to be handed over, unless called from the scheduler itself
+   # Without a thread the engine is closed right here, its driver runs on this same thread
+   def quit(self):
+      self.telemetry.stopDump()
+      self.__quit_now = True
+      if(self.thread == None): self.engine.close()
+      elif(threading.current_thread() != self.thread): self.thread.join()
@@ -1,39 +1,46 @@
-import time
-import threading
-import rtmidi
 from rtmidi.midiconstants import *
 from lib.Track import *
+from lib.Scheduler import *
+from lib.ClockFollower import *
+from lib.Session import *
+from lib.Render import *
 from lib.LaunchPad import *
+from lib.MidiBackend import *
+from lib.PortWriter import *
+from lib.AlsaBackend import *
+from lib.EngineLink import *
+from lib.Display import *
+from lib.View import *
 import sys
+import os
 import traceback
 
-MAX_TRACKS = 8
+MAX_TRACKS = 16
 MODE_SESSION = 200
 MODE_EDIT = 201
 MODE_GLOBAL = 202
 MODE_MIX = 202
 
-BPM_OFFSET = 60
-BPM_PER_BUTTON = 4
-
-MIDDLE_C = 48
-
 class Sequencer:
 
-   def __init__(self, lp, conf):
-      try:
-         self.output = rtmidi.MidiOut() 
-         self.output.open_port(int(conf['global']['midi_out']))
-      except:
-         print("Output Ports:\n" + str(self.output.get_ports()))
-         print("Can't open main MIDI output device, run 'cat /dev/sndstat' and check config file")
-         exit()  
+   def __init__(self, lp, conf, backend = None):
+      if(backend == None): backend = RtMidiBackend()
+      if(not isinstance(backend, WriterBackend)): backend = WriterBackend(backend)
+      # with runtime = process the engine process owns the output, not this one
+      runtime = conf['global'].get('runtime', 'threads')
+      self.output = None
+      if(runtime != 'process'): self.output = Sequencer.openOutput(conf, backend)
 
       self.config = conf
       self.pad = lp
+      # what each mode shows is worked out by its view, regions marked dirty get redone
+      self.view = View(lp)
+      self.session_view = SessionView(self)
+      self.edit_view = EditView(self)
+      self.global_view = GlobalView(self)
       self.bpm = int(conf['global']['bpm'])
-      self.clock_time_div = float(conf['global']['clock_div'])
-      self.clock_interval = (60.0 / self.bpm) / self.clock_time_div
+      self.tempo_quant = int(conf['global'].get('tempo_quant', 0))       # 1/16th steps, 0 = change on the next tick
+      self.tempo_ramp = int(conf['global'].get('tempo_ramp', 64))        # 1/16th steps for a long press ramp
       
       self.pad.btn_callback = self.buttonPressed
       self.pad.btn_long_callback = self.buttonPressedLong
@@ -43,15 +50,91 @@ class Sequencer:
       self.editing_track = None
       self.editing_page = None
       self.editing_offset = MIDDLE_C
+      self.track_offset = 0      # session view window over the clip matrix, first track shown
+      self.scene_offset = 0      # and first pattern shown on the top row
       
       self.tracks = []
       for t in range(MAX_TRACKS):
-         trk = Track(self, t, self.bpm)
+         trk = Track(self, t)
          self.tracks.append(trk)
 
-      self.__quit_now = False
-      threading.Timer(0, self.__mainloop).start()
+      if(runtime == 'process'):
+         # the scheduler runs in its own process, edits and launches get mirrored over to it
+         self.scheduler = EngineLink(self, conf)
+         self.follower = None
+      else:
+         # with the asyncio runtime the scheduler gets no thread, AsyncRuntime drives it
+         Sequencer.startEngine(self, conf, backend, runtime != 'asyncio')
+      # playhead LEDs are redrawn at their own rate, never by the engine
+      self.display = Display(self, float(conf['global'].get('display_hz', 30)), runtime != 'asyncio')
+      self.session = Session(conf['global'].get('session_file', 'data/session.bin'))
+      self.autosave = None
       
+   # Main MIDI output for the notes and clock, exits if it can't be opened
+   def openOutput(conf, backend):
+      out_backend = backend
+      if(conf['global'].get('midi_backend', 'rtmidi') == 'alsa'):
+         # notes and clock go through a timestamped kernel queue, handed over lookahead_ms early
+         try:
+            out_backend = AlsaBackend(float(conf['global'].get('lookahead_ms', 50)) / 1000.0)
+         except ImportError as e:
+            print("Can't use the ALSA sequencer output (" + str(e) + "), using rtmidi")
+      try:
+         # notes and clock jump the queue if the Launchpad shares the port
+         return out_backend.openOutput(int(conf['global']['midi_out']), True)
+      except:
+         print("Output Ports:\n" + str(out_backend.outputPorts()))
+         print("Can't open main MIDI output device, run 'cat /dev/sndstat' and check config file")
+         exit()
+
+   # One timeline drives the MIDI clock and every track of host, anything with tracks and output
+   # Sets host.scheduler and host.follower
+   def startEngine(host, conf, backend, threaded):
+      realtime = None
+      if(conf['global'].get('performance', 'no') == 'yes'):
+         realtime = Realtime(int(conf['global'].get('rt_priority', 50)), float(conf['global'].get('spin_ms', 1.0)) / 1000.0)
+      bpm = int(conf['global']['bpm'])
+      host.scheduler = Scheduler(host, bpm, float(conf['global']['clock_div']), int(conf['global'].get('launch_quant', 16)),
+                                 realtime, threaded)
+      host.scheduler.lookahead = getattr(host.output, 'lookahead', 0.0)
+      host.scheduler.timed = hasattr(host.output, 'sendTimed')
+      if(float(conf['global'].get('telemetry_dump', 0)) > 0):
+         host.scheduler.telemetry.startDump(float(conf['global']['telemetry_dump']))
+      host.follower = None
+      if(conf['global'].get('clock_source', 'internal') == 'external'):
+         # slave to the clock and transport coming in on clock_in, the tempo map is not used
+         try:
+            host.follower = ClockFollower(host.scheduler, backend, int(conf['global']['clock_in']), bpm)
+         except:
+            print("Can't open MIDI clock input device, check clock_in in config file")
+            traceback.print_exc()
+
+   # Load track data from the binary session file, falling back to the per track json files
+   def loadSession(self, path = None):
+      if(path != None): self.session = Session(path)
+      if(self.session.exists() and self.session.load(self.tracks)): return True
+      
+      for t in range(len(self.tracks)):
+         # skip missing files == default data
+         if(not os.path.isfile('data/track'+str(t)+'_data.json')): continue
+         self.tracks[t].loadJSON('data/track'+str(t)+'_data.json')
+      return False
+      
+   # Bounce to a Standard MIDI File without playing, the playing patterns looped for a number of bars
+   # or with nothing playing every session row in turn. Returns the length of music in seconds
+   def renderMidi(self, path, bars = 8):
+      renderer = Renderer(self.tracks, self.bpm)
+      if(all(trk.active_pat == None for trk in self.tracks)): return renderer.render(path)
+      return renderer.render(path, [([trk.active_pat for trk in self.tracks], bars)])
+      
+   # Start saving edits in the background, call once the track data is loaded
+   def startAutosave(self):
+      self.autosave = Autosave(self.session, self.tracks, float(self.config['global'].get('autosave', 2.0)))
+      
+   # The edited pattern's event table is rebuilt here rather than on the scheduler's next step
+   def compileEditing(self):
+      self.editing_track.compile(self.editing_track.active_pat)
+
    def buttonPressed(self, b):
       #print("   BUTTON="+str(b))
       #print("pages="+str(self.editing_track.getPlayingPattern().countPages()))
@@ -63,6 +146,11 @@ class Sequencer:
          self.startGlobalMode()
          return
          
+      # arrows move the session view one row or column
+      if(self.mode == MODE_SESSION and b < 4):
+         self.scrollSession(b, 1)
+         return
+         
       if(self.mode == MODE_EDIT):
          pages = self.editing_track.getPlayingPattern().countPages()
          # switch to page 0 
@@ -73,14 +161,14 @@ class Sequencer:
          if(b == 1):
             if(pages == 1):
                self.editing_track.getPlayingPattern().addPage()
-               self.pad.setButton(1, AMBER_FULL)
+               self.compileEditing()
             self.editPage(1, self.editing_offset)
             
          # add or switch to page 3
          if(b == 2):
             if(pages == 2):
                self.editing_track.getPlayingPattern().addPage()
-               self.pad.setButton(2, AMBER_FULL)
+               self.compileEditing()
                self.editPage(2, self.editing_offset)
             else: 
                if(pages >= 3): self.editPage(2, self.editing_offset)
@@ -89,7 +177,7 @@ class Sequencer:
          if(b == 3):
             if(pages == 3):
                self.editing_track.getPlayingPattern().addPage()
-               self.pad.setButton(3, AMBER_FULL)
+               self.compileEditing()
                self.editPage(3, self.editing_offset)
             else: 
                if(pages == 4): self.editPage(3, self.editing_offset)               
@@ -100,6 +188,11 @@ class Sequencer:
          self.quit()
          self.pad.close()
       
+      # held arrows move the session view a whole page
+      if(self.mode == MODE_SESSION and b < 4):
+         self.scrollSession(b, 8)
+         return
+         
       if(self.mode != MODE_EDIT): return
       
       pages = self.editing_track.getPlayingPattern().countPages()
@@ -108,19 +201,19 @@ class Sequencer:
       if(b == 1):
          if(pages == 2):
             self.editing_track.getPlayingPattern().removePage()
-            self.pad.setButton(1, LED_OFF)
+            self.compileEditing()
             self.editPage(0, self.editing_offset)
       # delete page 2
       if(b == 2):
          if(pages == 3):
             self.editing_track.getPlayingPattern().removePage()
-            self.pad.setButton(2, LED_OFF)
+            self.compileEditing()
             self.editPage(1, self.editing_offset)
       # delete page 3
       if(b == 3):
          if(pages == 4):
             self.editing_track.getPlayingPattern().removePage()
-            self.pad.setButton(3, LED_OFF)
+            self.compileEditing()
             self.editPage(2, self.editing_offset)         
 
                
@@ -129,12 +222,13 @@ class Sequencer:
       
       # side buttons are on x = 8
       if(x == 8):
+         # the octave buttons stop where the grid would run off the MIDI note range
          if(y == 4 and self.mode == MODE_EDIT): # snd b button on LP
-            self.editing_offset -= 8
+            self.editing_offset = max(0, self.editing_offset - 8)
             self.editPage(self.editing_page, self.editing_offset)
             return
          if(y == 5 and self.mode == MODE_EDIT): # snd b button on LP
-            self.editing_offset += 8
+            self.editing_offset = min(TOP_OFFSET, self.editing_offset + 8)
             self.editPage(self.editing_page, self.editing_offset)
             return
          if(y == 3): # STOP button on LP
@@ -148,6 +242,7 @@ class Sequencer:
                self.startSessionMode()
          if(y == 0 and self.mode == MODE_EDIT):
             self.editing_track.getPlayingPattern().delete() #.steps = [Step() for s in range (8)]
+            self.compileEditing()
             self.editing_track.stopPlaying()
             self.editing_track = None
             self.startSessionMode()
@@ -162,35 +257,30 @@ class Sequencer:
          # switch off note
          if(y == old_note_y):
             pat.steps[x + page_offset].note = 0
-            colour = LED_OFF
-            if((self.editing_offset + y) % 12 in [1, 3, 6, 8, 10]): colour = RED_DIM
-            self.pad.setLED(x, y, colour)
             pat.note_count -= 1
          else:
             # monophonic so only a single note at each step
             pat.steps[x + page_offset].note = y + self.editing_offset
             pat.note_count += 1
-            if(old_note_y >= 0 and old_note_y <= 7): self.pad.setLED(x, old_note_y, LED_OFF)
-            self.pad.setLED(x, y, AMBER_FULL)
+         self.compileEditing()
+         # only this step's column can have changed
+         self.view.invalidate(x)
+         self.view.update()
       
       if(self.mode == MODE_SESSION):
-         pat_num = 7 - y
-         trk = self.tracks[x]
+         pat_num = self.scene_offset + 7 - y
+         trk = self.tracks[self.track_offset + x]
          
          # if pressed empty pattern - then edit it
-         if(trk.patterns[pat_num].isEmpty()):
-            self.startEditMode(x, pat_num, 0)
+         if(trk.patterns.isEmpty(pat_num)):
+            self.startEditMode(self.track_offset + x, pat_num, 0)
          else:
-            # if playing, turn off old light
-            if(trk.isPlaying()): 
-               self.pad.setLED(x, 7 - trk.getPlayingPatternNum(), AMBER_FULL)
-               # if pressed playing pattern then stop it
-               if(trk.getPlayingPatternNum() == pat_num): 
-                  trk.stopPlaying()
-                  return
-            # now play selected track
-            trk.playPattern(pat_num)
-            self.pad.setLED(x, y, GREEN_FULL)
+            # if pressed playing pattern then stop it, else play it
+            if(trk.getPlayingPatternNum() == pat_num): trk.stopPlaying()
+            else: trk.playPattern(pat_num)
+            # the old and new playing pattern are both in this track's column
+            self.view.invalidate(x)
+            self.view.update()
             
       if(self.mode == MODE_GLOBAL):
          bpm = (((y * 8) + x) * BPM_PER_BUTTON) + BPM_OFFSET
@@ -200,29 +290,19 @@ class Sequencer:
    def gridPressedLong(self, b):
       x, y = LaunchPad.convertToXY(b)
       print("grid press long - here {} {}".format(x, y))
-      if(self.mode == MODE_SESSION):
-         pat_num = 7 - y
-         self.startEditMode(x, pat_num, 0)
+      if(self.mode == MODE_SESSION and x < 8):
+         self.startEditMode(self.track_offset + x, self.scene_offset + 7 - y, 0)
+      if(self.mode == MODE_GLOBAL and x < 8):
+         self.rampBPM((((y * 8) + x) * BPM_PER_BUTTON) + BPM_OFFSET, self.tempo_ramp)
+         self.paintBPM()
   
-   def __mainloop(self):
-      while not self.__quit_now:
-         #pass
-         time.sleep(self.clock_interval / 6) # every six beats (send clock in 1/16th time)
-         self.output.send_message([TIMING_CLOCK]) 
-
    def startGlobalMode(self):
       print("start global mode")
       self.mode = MODE_GLOBAL
-      self.pad.clear()
-      self.pad.setButton(6, GREEN_FULL)
-      self.paintBPM()
+      self.view.show(self.global_view)
          
    def startEditMode(self, trk_num, pat_num, pg_num):
       print("start edit mode", trk_num, pat_num, pg_num)
-      self.pad.clear()
-      self.pad.setButton(5, GREEN_FULL) # turn on user 1 button on LP
-      self.pad.setLED(8, 0, RED_FULL)
-      self.pad.setLED(8, 3, RED_FULL)
       self.editing_offset = MIDDLE_C
 
       try:
@@ -230,124 +310,61 @@ class Sequencer:
          self.editing_track = self.tracks[trk_num]
 		   # IMPORTANT MIGHT WANT TO CHANGE THIS LATER
          self.editing_track.playPattern(pat_num)
-         # set the four buttons for each page 
-         for p in range(self.editing_track.getPlayingPattern().countPages()):
-            self.pad.setButton(p, AMBER_FULL)
          print("# About to change page")
          self.editPage(pg_num, self.editing_offset)
       except:
          print(traceback.format_exc())
 
    def startSessionMode(self):
-      self.pad.clear()
       self.mode = MODE_SESSION
-      for p in range(8):
-         self.pad.setButton(p, LED_OFF)
-      self.pad.setButton(4, GREEN_FULL)
+      self.view.show(self.session_view)
       
-      # load patterns gubbins here.   
-      self.pad.clearGrid()
-      t = 0
-      for trk in self.tracks:
-         p = 0
-         for pat in trk.patterns:
-            if not pat.isEmpty():
-               col = AMBER_FULL
-               if(trk.active_pat == p): col = GREEN_FULL
-               self.pad.setLED(t, 7 - p, col)
-            p += 1
-         t += 1
+   # Move the session view, b is the arrow (up, down, left, right), by rows or columns
+   def scrollSession(self, b, n):
+      if(b == 0): self.scene_offset = max(0, self.scene_offset - n)
+      if(b == 1): self.scene_offset = min(MAX_PATTERNS - 8, self.scene_offset + n)
+      if(b == 2): self.track_offset = max(0, self.track_offset - n)
+      if(b == 3): self.track_offset = max(0, min(len(self.tracks) - 8, self.track_offset + n))
+      self.startSessionMode()
 
+   # A new page or octave changes every step's column, the page buttons and the octave buttons
    def editPage(self, page, offset):
-      #print("## CHANGE PAGE", self.editing_page , page)
-      
-      n = int((offset - MIDDLE_C) / 8)
-      if(n == -1): 
-         self.pad.setLED(8, 5, LED_OFF)
-         self.pad.setLED(8, 4, GREEN_FULL)
-      if(n == -2): 
-         self.pad.setLED(8, 5, LED_OFF)
-         self.pad.setLED(8, 4, GREEN_FULL + RED_MID)
-      if(n == -3): 
-         self.pad.setLED(8, 5, LED_OFF)
-         self.pad.setLED(8, 4, AMBER_FULL)
-      if(n == -4): 
-         self.pad.setLED(8, 5, LED_OFF)
-         self.pad.setLED(8, 4, GREEN_MID + RED_FULL)
-      if(n <= -5): 
-         self.pad.setLED(8, 5, LED_OFF)
-         self.pad.setLED(8, 4, RED_FULL)
-         
-      if(n == 0): 
-         self.pad.setLED(8, 4, LED_OFF)
-         self.pad.setLED(8, 5, GREEN_FULL)
-      if(n == 1): 
-         self.pad.setLED(8, 4, LED_OFF)
-         self.pad.setLED(8, 5, GREEN_FULL + RED_MID)
-      if(n == 2): 
-         self.pad.setLED(8, 4, LED_OFF)
-         self.pad.setLED(8, 5, AMBER_FULL)
-      if(n == 3): 
-         self.pad.setLED(8, 4, LED_OFF)
-         self.pad.setLED(8, 5, GREEN_MID + RED_FULL)
-      if(n >= 4): 
-         self.pad.setLED(8, 4, LED_OFF)
-         self.pad.setLED(8, 5, RED_FULL)
-         
-      for p in range(self.editing_track.getPlayingPattern().countPages()):
-         self.pad.setButton(p, AMBER_FULL)
-      self.pad.setButton(page, RED_FULL)
       self.editing_page = page
-      
-      # clear grid and paint black keys as dim green
-      for y in range(8):
-         colour = LED_OFF
-         if((offset + y) % 12 in [1, 3, 6, 8, 10]): colour = RED_DIM
-         for x in range(8):
-            self.pad.setLED(x, y, colour)
-
-      # load grid for page
-      x = 0 
-      y = 0
-      for s in range(page * 8, (page * 8) + 8):
-         y = self.editing_track.getPlayingPattern().steps[s].note - offset
-         if(y < 0 or y > 7): 
-            x += 1
-            continue
-         self.pad.setLED(x, y, AMBER_FULL)
-         x += 1
+      self.editing_offset = offset
+      self.view.show(self.edit_view)
 
-   def lightstep_on(self, offset, note, track):
-      if(self.editing_track != track): return
-      if(self.mode != MODE_EDIT): return
-	  
-      if(offset >= (self.editing_page * 8) and offset < ((self.editing_page + 1) * 8)): 
-         x = offset % 8
-         y = note - self.editing_offset
-         if(y < 0 or y > 7): return
-         self.pad.setLED(x, y, GREEN_FULL)
-      else:
-         # Pointless code but only way to get the Launchpad to light up correctly
-         self.pad.setButton(int(offset/8), GREEN_FULL)
+   # Cells the playheads light in the current mode, the Display draws these over the view
+   # In session mode the playing clip of every track in view pulses on the beat
+   def playheadCells(self, playheads):
+      cells = {}
+      if(self.mode == MODE_EDIT and self.editing_track != None):
+         lit = playheads[self.editing_track.tracknum]
+         if(lit == None or lit[0] != self.editing_track.getPlayingPatternNum()): return cells
+         pattern, offset, note = lit
+         if(offset >= (self.editing_page * 8) and offset < ((self.editing_page + 1) * 8)):
+            y = note - self.editing_offset
+            if(note > 0 and y >= 0 and y <= 7): cells[(offset % 8, y)] = GREEN_FULL
+         else:
+            # Pointless code but only way to get the Launchpad to light up correctly
+            cells[(int(offset / 8), TOP_ROW)] = GREEN_FULL
+      if(self.mode == MODE_SESSION):
+         for x in range(min(8, len(self.tracks) - self.track_offset)):
+            lit = playheads[self.track_offset + x]
+            if(lit == None or lit[1] % 4 != 0): continue
+            row = lit[0] - self.scene_offset
+            if(row >= 0 and row < 8): cells[(x, 7 - row)] = GREEN_MID
+      return cells
 
-   def lightstep_off(self, offset, note, track):
-      if(self.editing_track != track): return
-      if(self.mode != MODE_EDIT): return
-	  
-      if(offset >= (self.editing_page * 8) and offset < ((self.editing_page + 1) * 8)): 
-         x = offset % 8
-         y = note - self.editing_offset
-         if(y < 0 or y > 7): return
-         self.pad.setLED(x, y, AMBER_FULL)
-      else:
-         # Pointless code but only way to get the Launchpad to light up correctly
-         self.pad.setButton(int(offset/8), AMBER_FULL)
-         
    def quit(self):
-      self.__quit_now = True
+      self.display.quit()
+      self.scheduler.quit()
+      if(self.follower != None): self.follower.quit()
+      if(self.autosave != None): self.autosave.quit()
       for trk in self.tracks: trk.quit()
-      self.output.send_message([CONTROLLER_CHANGE, ALL_NOTES_OFF, 0])
-      self.output.send_message([CONTROLLER_CHANGE, 120, 0])   
+      if(self.output != None):
+         self.output.send_message([CONTROLLER_CHANGE, ALL_NOTES_OFF, 0])
+         self.output.send_message([CONTROLLER_CHANGE, 120, 0])   
+         self.output.close_port()
       
       self.config['global']['bpm'] = str(self.bpm)
       cfgfile = open("config.cfg", 'w')
@@ -356,11 +373,14 @@ class Sequencer:
 
    def setBPM(self, bpm):
       self.bpm = bpm
-      self.clock_interval = (60.0 / self.bpm) / self.clock_time_div  
-      for trk in self.tracks:
-         trk.setBPM(bpm)
+      self.scheduler.setBPM(bpm, self.tempo_quant)
+         
+   # Glide to a new tempo over a number of 1/16th steps
+   def rampBPM(self, bpm, steps):
+      self.bpm = bpm
+      self.scheduler.rampBPM(bpm, steps, self.tempo_quant)
          
+   # Only the grid shows the tempo, and only the pads that changed get sent
    def paintBPM(self):
-      self.pad.clearGrid()
-      for i in range(int ((self.bpm - BPM_OFFSET) / BPM_PER_BUTTON) + 1):
-         self.pad.setLED(i % 8, int(i / 8), GREEN_FULL)
\ No newline at end of file
+      self.view.invalidate(*GRID)
+      self.view.update()
\ No newline at end of file
@@ -0,0 +1,122 @@
+import os
+import struct
+import threading
+from array import array
+from lib.Pattern import *
+
+MAGIC = b'LPSQ'
+VERSION = 2
+MAX_STEPS = 32                         # four pages, every pattern gets a slot this big
+
+HEADER = struct.Struct('<4sHHHH')      # magic, version, tracks, patterns per track, MAX_STEPS
+ENTRY = struct.Struct('<HH')           # steps used in the slot, notes in them
+SLOT_SIZE = MAX_STEPS * 8              # notes, vels, ratchets, actives as bytes + gates as float32
+
+#
+# Binary session file, a fixed size header then one fixed size slot per pattern
+# Slots never move, so a single pattern can be rewritten in place and the whole file
+# can be memory mapped and read in one go. Columns are stored in native byte order
+#
+class Session:
+
+   def __init__(self, path):
+      self.path = path
+      self.loaded = False       # True once the file on disk is known to match the tracks
+
+   def exists(self):
+      return os.path.isfile(self.path)
+
+   def slotOffset(self, num_patterns, t, p):
+      return HEADER.size + ((t * num_patterns) + p) * (ENTRY.size + SLOT_SIZE)
+
+   # pat can be None for a pattern that was never created
+   def packPattern(self, pat):
+      data = pat.data if pat != None else EMPTY
+      n = min(len(data), MAX_STEPS)
+      pad = MAX_STEPS - n
+      return ENTRY.pack(n, n - data.notes[:n].count(0)) + \
+             data.notes[:n].tobytes() + bytes(pad) + \
+             data.vels[:n].tobytes() + bytes(pad) + \
+             data.ratchets[:n].tobytes() + bytes(pad) + \
+             data.actives[:n].tobytes() + bytes(pad) + \
+             data.gates[:n].tobytes() + bytes(pad * 4)
+
+   def unpackPattern(self, buf, offset):
+      n, note_count = ENTRY.unpack_from(buf, offset)
+      col = offset + ENTRY.size
+      notes = array('B', buf[col : col + n])
+      vels = array('B', buf[col + MAX_STEPS : col + MAX_STEPS + n])
+      ratchets = array('B', buf[col + (MAX_STEPS * 2) : col + (MAX_STEPS * 2) + n])
+      actives = array('B', buf[col + (MAX_STEPS * 3) : col + (MAX_STEPS * 3) + n])
+      gates = array('f', buf[col + (MAX_STEPS * 4) : col + (MAX_STEPS * 4) + (n * 4)])
+      return PatternData(notes, vels, gates, ratchets, actives)
+
+   # Write the whole session, to a temp file first so a crash never leaves half a file
+   def save(self, tracks):
+      num_patterns = len(tracks[0].patterns)
+      tmp_path = self.path + '.tmp'
+      with open(tmp_path, 'wb') as f:
+         f.write(HEADER.pack(MAGIC, VERSION, len(tracks), num_patterns, MAX_STEPS))
+         for trk in tracks:
+            for p in range(num_patterns): f.write(self.packPattern(trk.patterns.peek(p)))
+      os.replace(tmp_path, self.path)
+      self.loaded = True
+
+   # Rewrite just one pattern's slot
+   def savePattern(self, tracks, t, p):
+      with open(self.path, 'r+b') as f:
+         f.seek(self.slotOffset(len(tracks[0].patterns), t, p))
+         f.write(self.packPattern(tracks[t].patterns.peek(p)))
+
+   # Load every track with one read of the file, returns False if the file doesn't fit these tracks
+   # Patterns just keep a reference into the buffer and are only unpacked when first used
+   # A file with fewer tracks or patterns loads into the first ones, then gets rewritten whole
+   def load(self, tracks):
+      with open(self.path, 'rb') as f:
+         buf = f.read()
+      magic, version, num_tracks, num_patterns, max_steps = HEADER.unpack_from(buf, 0)
+      if(magic != MAGIC or version != VERSION or max_steps != MAX_STEPS): return False
+      if(num_tracks > len(tracks) or num_patterns > len(tracks[0].patterns)): return False
+      for t in range(num_tracks):
+         for p in range(num_patterns):
+            offset = self.slotOffset(num_patterns, t, p)
+            n, note_count = ENTRY.unpack_from(buf, offset)
+            if(note_count == 0 and n == PAGE_LEN): continue     # nothing saved, leave as the shared empty one
+            tracks[t].patterns[p].setRaw(lambda offset=offset: self.unpackPattern(buf, offset), note_count)
+      self.loaded = (num_tracks == len(tracks) and num_patterns == len(tracks[0].patterns))
+      return True
+
+#
+# Background saver, wakes up every interval and writes only the patterns edited since last time
+# It only ever reads published pattern snapshots, so the playback side never waits on it
+#
+class Autosave:
+
+   def __init__(self, session, tracks, interval):
+      self.session = session
+      self.tracks = tracks
+      self.interval = interval
+      if(not session.loaded): session.save(tracks)
+      self.saved = [{p: pat.version for p, pat in trk.patterns.items()} for trk in tracks]
+
+      self.__quit_now = threading.Event()
+      threading.Timer(0, self.__mainloop).start()
+
+   def save(self):
+      for t in range(len(self.tracks)):
+         for p, pat in self.tracks[t].patterns.items():
+            version = pat.version
+            if(version == self.saved[t].get(p, 0)): continue
+            self.session.savePattern(self.tracks, t, p)
+            self.saved[t][p] = version
+
+   def __mainloop(self):
+      while not self.__quit_now.wait(self.interval):
+         try:
+            self.save()
+         except OSError as e:
+            print("Autosave failed: " + str(e))
+      self.save()
+
+   def quit(self):
+      self.__quit_now.set()
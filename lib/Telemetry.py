@@ -0,0 +1,127 @@
+import threading
+from array import array
+from rtmidi.midiconstants import *
+
+RING_SIZE = 1024
+HISTOGRAM_MS = [0.1, 0.5, 1.0, 2.0, 5.0, 10.0]    # upper edges of the lateness buckets, last bucket is open
+
+#
+# Fixed size ring of (scheduled, actual) timestamp pairs, one writer and no locking
+#
+class Ring:
+
+   def __init__(self, size = RING_SIZE):
+      self.scheduled = array('d', [0.0] * size)
+      self.actual = array('d', [0.0] * size)
+      self.count = 0
+
+   def add(self, scheduled, actual):
+      i = self.count % len(self.scheduled)
+      self.scheduled[i] = scheduled
+      self.actual[i] = actual
+      self.count += 1
+
+   # Samples in the order they were recorded, oldest first
+   def samples(self):
+      size = len(self.scheduled)
+      if(self.count <= size): return list(zip(self.scheduled[:self.count], self.actual[:self.count]))
+      i = self.count % size
+      return list(zip(self.scheduled[i:] + self.scheduled[:i], self.actual[i:] + self.actual[:i]))
+
+#
+# Timing telemetry for the playback engine
+# Records when each message was due and when it actually went out, per MIDI channel and for the
+# clock. Through a port writer that is the writer thread once send_message returned, outputs
+# without one are recorded by the scheduler when it hands the batch over (ahead of time with a
+# lookahead). Stats are worked out only when asked for
+#
+class Telemetry:
+
+   def __init__(self):
+      self.tracks = {}          # channel -> Ring
+      self.clock = Ring()
+      self.input = Ring()       # external clock pulses, against where the follower expected them
+      self.info = {}            # anything else worth showing with the numbers, like the performance mode
+      self.__dump_timer = None
+
+   def recordNote(self, channel, scheduled, actual):
+      ring = self.tracks.get(channel)
+      if(ring == None):
+         ring = Ring()
+         self.tracks[channel] = ring
+      ring.add(scheduled, actual)
+
+   def recordClock(self, scheduled, actual):
+      self.clock.add(scheduled, actual)
+
+   # Everything in one batch went out for the same scheduled time
+   def recordBatch(self, msgs, scheduled, actual):
+      for msg in msgs:
+         if(msg[0] < 0xF0): self.recordNote(msg[0] & 0x0F, scheduled, actual)
+         elif(msg[0] == TIMING_CLOCK): self.recordClock(scheduled, actual)
+
+   def recordInput(self, predicted, actual):
+      self.input.add(predicted, actual)
+
+   def percentiles(values):
+      if(len(values) == 0): return {"p50": 0.0, "p99": 0.0, "max": 0.0}
+      values = sorted(values)
+      return {"p50": values[int(len(values) * 0.5)], "p99": values[min(len(values) - 1, int(len(values) * 0.99))],
+              "max": values[-1]}
+
+   def histogram(values):
+      buckets = [0] * (len(HISTOGRAM_MS) + 1)
+      for v in values:
+         b = 0
+         while b < len(HISTOGRAM_MS) and v > HISTOGRAM_MS[b]: b += 1
+         buckets[b] += 1
+      return buckets
+
+   # Lateness and jitter (change in lateness between events) in ms, for one ring
+   def ringStats(ring):
+      samples = ring.samples()
+      late = [(actual - scheduled) * 1000.0 for scheduled, actual in samples]
+      jitter = [abs(late[i] - late[i - 1]) for i in range(1, len(late))]
+      return {"count": ring.count, "late": Telemetry.percentiles(late), "jitter": Telemetry.percentiles(jitter),
+              "histogram": Telemetry.histogram(late)}
+
+   # Everything as a dict, per channel plus the clock and its period error
+   def stats(self):
+      stats = {"tracks": {}}
+      for channel, ring in list(self.tracks.items()):
+         stats["tracks"][channel] = Telemetry.ringStats(ring)
+      stats["clock"] = Telemetry.ringStats(self.clock)
+      samples = self.clock.samples()
+      period_err = [abs((samples[i][1] - samples[i - 1][1]) - (samples[i][0] - samples[i - 1][0])) * 1000.0
+                    for i in range(1, len(samples))]
+      stats["clock"]["period_error"] = Telemetry.percentiles(period_err)
+      if(self.input.count > 0): stats["input"] = Telemetry.ringStats(self.input)
+      stats["info"] = dict(self.info)
+      return stats
+
+   def dump(self):
+      stats = self.stats()
+      line = "{:>6} n={:<7} late p50={:.3f} p99={:.3f} max={:.3f}  jitter p50={:.3f} p99={:.3f} max={:.3f} ms"
+      extra = "".join(", {} {}".format(k, v) for k, v in stats["info"].items())
+      print("## Timing, last {} events per channel{}".format(RING_SIZE, extra))
+      rows = [("clock", stats["clock"])] + ([("in", stats["input"])] if "input" in stats else [])
+      for name, s in rows + [("ch" + str(c + 1), s) for c, s in sorted(stats["tracks"].items())]:
+         print(line.format(name, s["count"], s["late"]["p50"], s["late"]["p99"], s["late"]["max"],
+                           s["jitter"]["p50"], s["jitter"]["p99"], s["jitter"]["max"]))
+      err = stats["clock"]["period_error"]
+      print("   clock period error p50={:.3f} p99={:.3f} max={:.3f} ms".format(err["p50"], err["p99"], err["max"]))
+
+   # Print the stats every interval seconds
+   def startDump(self, interval):
+      self.__dump_timer = threading.Timer(interval, self.__dumpLoop, [interval])
+      self.__dump_timer.start()
+
+   def __dumpLoop(self, interval):
+      if(self.__dump_timer == None): return
+      self.dump()
+      self.startDump(interval)
+
+   def stopDump(self):
+      timer = self.__dump_timer
+      self.__dump_timer = None
+      if(timer != None): timer.cancel()
@@ -0,0 +1,70 @@
+from array import array
+
+#
+# One tempo segment, from start_tick onwards. A ramp goes linearly in bpm from bpm to end_bpm
+# over length ticks, with the time of every tick in it worked out up front
+#
+class Segment:
+   __slots__ = ('start_tick', 'start_time', 'bpm', 'end_bpm', 'length', 'offsets')
+
+   def __init__(self, start_tick, start_time, bpm, end_bpm = None, length = 0, ticks_per_beat = 24):
+      self.start_tick = start_tick
+      self.start_time = start_time
+      self.bpm = bpm
+      self.end_bpm = bpm if end_bpm == None else end_bpm
+      self.length = length
+      self.offsets = None
+      if(length > 0):
+         self.offsets = array('d', [0.0] * (length + 1))
+         t = 0.0
+         for k in range(length):
+            self.offsets[k] = t
+            t += 60.0 / (bpm + ((self.end_bpm - bpm) * k / length)) / ticks_per_beat
+         self.offsets[length] = t
+
+#
+# Tempo map for the transport, turns a tick number into seconds from the start
+# Every track and the clock read their deadlines from here, so a change or a ramp moves
+# them all together. The segment list is swapped whole, the scheduler never sees half an edit
+#
+class TempoMap:
+
+   def __init__(self, bpm, ticks_per_beat):
+      self.ticks_per_beat = ticks_per_beat
+      self.segments = (Segment(0, 0.0, bpm),)
+
+   def interval(self, bpm):
+      return 60.0 / bpm / self.ticks_per_beat
+
+   def segmentAt(self, tick, segments):
+      for seg in reversed(segments):
+         if(seg.start_tick <= tick): return seg
+      return segments[0]
+
+   # Seconds from the start of the transport to the given tick
+   def time(self, tick):
+      seg = self.segmentAt(tick, self.segments)
+      n = tick - seg.start_tick
+      if(seg.offsets == None): return seg.start_time + (n * self.interval(seg.bpm))
+      if(n <= seg.length): return seg.start_time + seg.offsets[n]
+      return seg.start_time + seg.offsets[seg.length] + ((n - seg.length) * self.interval(seg.end_bpm))
+
+   def bpmAt(self, tick):
+      seg = self.segmentAt(tick, self.segments)
+      if(seg.offsets == None or tick - seg.start_tick >= seg.length): return seg.end_bpm
+      return seg.bpm + ((seg.end_bpm - seg.bpm) * (tick - seg.start_tick) / seg.length)
+
+   # Replace everything from at_tick on, now_tick is the earliest tick still to be played
+   def __change(self, now_tick, at_tick, new):
+      segments = self.segments
+      keep = [seg for seg in segments if seg.start_tick < at_tick]
+      while len(keep) > 1 and keep[1].start_tick <= now_tick: keep.pop(0)
+      self.segments = tuple(keep + new)
+
+   def setBPM(self, bpm, now_tick, at_tick):
+      self.__change(now_tick, at_tick, [Segment(at_tick, self.time(at_tick), bpm)])
+
+   # Linear ramp from whatever the tempo is at at_tick to bpm over length ticks
+   def ramp(self, bpm, now_tick, at_tick, length):
+      seg = Segment(at_tick, self.time(at_tick), self.bpmAt(at_tick), bpm, max(1, length), self.ticks_per_beat)
+      self.__change(now_tick, at_tick, [seg])
@@ -1,105 +1,72 @@
-import threading
-import time
 import rtmidi
 from rtmidi.midiconstants import *
 from lib.LaunchPad import *
+from lib.Pattern import *
 import json
 
-MAX_PATTERNS = 8
-
-class Pattern:
-   def __init__(self):
-      self.empty = True
-      self.active = False
-      #self.editing = False
-      self.steps = [Step(0, 127, 0.9) for s in range (8)]
-      self.note_count = 0
-   
-   def addPage(self):
-      for s in range(8):
-         stp = Step(0, 127, 0.9)
-         self.steps.append(stp)
-         
-   #def editPattern(self):
-   #   self.editing = True
-
-   #def editPatternStop(self):
-   #   self.editing = False
-      
-   def removePage(self):
-      new_len = len(self.steps) - 8
-      self.steps = self.steps[:new_len]
-      
-   def countPages(self):
-      #print("len="+str(len(self.steps)))
-      return int(len(self.steps) / 8)
-      
-   def isEmpty(self):
-      return self.note_count <= 0
-         
-   def delete(self):
-      self.empty = True
-      self.active = False      
-      self.steps = [Step(0, 127, 0.9) for s in range (8)]
-      self.note_count = 0
-      
-      
-      
-class Step:
-   def __init__(self, n, v, g):
-      self.note = n
-      self.vel  = v
-      self.gate = g
-      self.active = True
-  
+MAX_PATTERNS = 64
 
 class Track:
-   def __init__(self, seq, midi_channel, bpm):
+   def __init__(self, seq, midi_channel):
       self.channel = midi_channel
       self.tracknum = midi_channel
       self.seq = seq
-      self.patterns = [Pattern() for p in range(MAX_PATTERNS)]
+      self.patterns = PatternBank(MAX_PATTERNS)
       self.active_pat = None
       
       self.timediv = 4.0
-      self.bpm = bpm
-      self.interval = (60.0 / self.bpm) / self.timediv
       
-      self.__quit_now = False
-      threading.Timer(0, self.__mainloop).start()
+      self.position = 0          # next step offset within the playing pattern
+      self.playing_pat = None    # pattern actually sounding, catches up with active_pat at launch()
+      self.compiled = {}         # pattern number -> (snapshot, its event table)
       
-   def __mainloop(self):
-      while not self.__quit_now:
-         if(self.active_pat == None):          
-            time.sleep(self.interval)
+   # Called by the scheduler on launch boundaries, so queued changes on every track land together
+   def launch(self):
+      if(self.playing_pat == self.active_pat): return
+      self.playing_pat = self.active_pat
+      self.position = 0
+      
+   # Called by the scheduler on every step boundary, returns (offset, pattern snapshot) or None when idle
+   # The snapshot is taken once per step, so edits land whole on the next step and never mid step
+   def nextStep(self):
+      playing_pat = self.playing_pat
+      if(playing_pat == None): return None
+      
+      data = self.patterns[playing_pat].data
+      if(self.position >= len(data)): self.position = 0
+      offset = self.position
+      self.position += 1
+      return offset, data
+   
+   # What each step of a snapshot plays, None for a rest or a tuple of (start, length, note on, note off)
+   # with start and length as fractions of the step, so a tempo change never needs a rebuild
+   # Snapshots never change, any edit publishes a new one and that gets its own table
+   def eventTable(self, p, data):
+      source, table = self.compiled.get(p, (None, None))
+      if(source is data): return table
+      table = []
+      for i in range(len(data)):
+         note = data.notes[i]
+         if(note <= 0 or not data.actives[i]):
+            table.append(None)
             continue
-         offset = 0
-         interval_t = self.interval # take copy outside of loop in case of user changes
-         for step in self.patterns[self.active_pat].steps: 
-            note = step.note
-            velo = step.vel
-            notetime = step.gate * interval_t
+         # a ratchet splits the step into equal hits, a gate over 1.0 ties into following steps
+         hit = 1.0 / data.ratchets[i]
+         on = bytes([self.channel | NOTE_ON, note, data.vels[i]])
+         off = bytes([self.channel | NOTE_OFF, note, 0])
+         table.append(tuple((r * hit, data.gates[i] * hit, on, off) for r in range(data.ratchets[i])))
+      self.compiled[p] = (data, table)
+      return table
 
-            #if(self.patterns[self.active_pat].editing):
-            self.seq.lightstep_on(offset, note, self)            
-            
-            if(note <= 0):
-               time.sleep(interval_t)
-            else:
-               #print("##NOTE## {}:{} ({})".format(self.channel, note, offset))
-               self.seq.output.send_message([self.channel | NOTE_ON, note, velo]) 
-               time.sleep(notetime)
-               self.seq.output.send_message([self.channel | NOTE_OFF, note, 0])
-               time.sleep(interval_t - notetime)
-            
-            self.seq.lightstep_off(offset, note, self)
-            offset = offset + 1
-   
-   def setBPM(self, bpm):
-      self.bpm = bpm
-      self.interval = (60.0 / self.bpm) / self.timediv
-      
+   # Build the table for a pattern's current snapshot now, on the caller's thread, so the
+   # scheduler finds it ready. Called after every edit and when a pattern is launched
+   def compile(self, p):
+      if(p != None): self.eventTable(p, self.patterns[p].data)
+
+   # Pattern changes and stops are queued, they start sounding on the next launch boundary
+   # The pattern is unpacked and compiled here, so the player never has to
    def playPattern(self, p):
+      self.compile(p)
       self.active_pat = p
 
    def stopPlaying(self):
@@ -114,13 +81,22 @@ class Track:
    def getPlayingPatternNum(self):
       return self.active_pat
    
+   # Load patterns saved by quit(), steps are only loaded for patterns with notes in,
+   # the rest stay as the shared empty pattern
+   def loadJSON(self, path):
+      with open(path) as json_file:
+         track_data = json.load(json_file)
+      for pat_num, pat in enumerate(track_data['patterns']):
+         if(any(step['note'] != 0 for step in pat['steps']) or len(pat['steps']) != PAGE_LEN):
+            self.patterns[pat_num].loadSteps(pat['steps'])
+   
+   # Only writes up to the last pattern with something in it, empty slots before it keep their place
    def quit(self):
-      self.__quit_now = True
       dict = {"patterns":[]}
-      for p in range(len(self.patterns)):
-         dict['patterns'].append({"steps":[]})
-         for s in range(len(self.patterns[p].steps)):
-            dict['patterns'][p]['steps'].append(self.patterns[p].steps[s].__dict__)
+      used = [p for p, pat in self.patterns.items() if not pat.isEmpty()]
+      for p in range((max(used) + 1) if len(used) > 0 else 0):
+         pat = self.patterns.peek(p)
+         dict['patterns'].append({"steps": pat.saveSteps() if pat != None else Pattern().saveSteps()})
       with open('data/track'+str(self.tracknum)+'_data.json', 'w') as outfile:
          json.dump(dict, outfile)
       
\ No newline at end of file
@@ -0,0 +1,154 @@
+from lib.LaunchPad import *
+
+BPM_OFFSET = 60
+BPM_PER_BUTTON = 4
+MIDDLE_C = 48
+TOP_OFFSET = 120        # highest editing offset that keeps the top row of the grid a MIDI note
+BLACK_KEYS = [1, 3, 6, 8, 10]
+# side button colours for how many octaves the edit grid is moved off middle C
+OCTAVE_COLOURS = [GREEN_FULL, GREEN_FULL + RED_MID, AMBER_FULL, GREEN_MID + RED_FULL, RED_FULL]
+
+# A view is worked out a region at a time, the grid columns and the side buttons are
+# regions 0 to 8 (their x), the round buttons along the top are TOP
+SIDE = 8
+TOP = 'top'
+GRID = list(range(8))
+REGIONS = GRID + [SIDE, TOP]
+
+#
+# What the Launchpad shows, worked out from the model instead of painted step by step
+# Each mode has a view that gives the colours of one column or of the top row straight from the
+# sequencer's state. A change to the model marks the regions it touches dirty and update works
+# out only those, then only the cells whose colour actually changed go into a LaunchPad frame
+# The Display's playheads are an overlay drawn over the top
+#
+class View:
+
+   def __init__(self, pad):
+      self.pad = pad
+      self.mode = None
+      self.cells = dict.fromkeys(CELLS)   # (x, y) -> colour the mode's view wants, under the overlay
+      self.overlay = {}                    # (x, y) -> colour of a playhead
+      self.dirty = set()
+
+   # Switch to a mode's view, every cell is worked out again, the LaunchPad still only sends
+   # the ones that differ from what it is showing
+   def show(self, mode):
+      self.mode = mode
+      self.cells = dict.fromkeys(CELLS)
+      self.overlay = {}
+      self.invalidate(*REGIONS)
+      self.update()
+
+   def invalidate(self, *regions):
+      self.dirty.update(regions)
+
+   def update(self):
+      if(self.mode == None or len(self.dirty) == 0): return
+      changed = []
+      for region in self.dirty:
+         if(region == TOP): cells = [((b, TOP_ROW), c) for b, c in enumerate(self.mode.top())]
+         else: cells = [((region, y), c) for y, c in enumerate(self.mode.column(region))]
+         for cell, c in cells:
+            if(self.cells[cell] == c): continue
+            self.cells[cell] = c
+            changed.append(cell)
+      self.dirty.clear()
+      self.pad.beginFrame()
+      for x, y in changed: self.pad.setCell(x, y, self.overlay.get((x, y), self.cells[(x, y)]))
+      self.pad.commit()
+
+   # Swap the playhead overlay, cells it no longer covers go back to the view underneath
+   def setOverlay(self, overlay):
+      self.pad.beginFrame()
+      for x, y in self.overlay:
+         if((x, y) not in overlay and self.cells[(x, y)] != None): self.pad.setCell(x, y, self.cells[(x, y)])
+      for (x, y), c in overlay.items(): self.pad.setCell(x, y, c)
+      self.pad.commit()
+      self.overlay = overlay
+
+#
+# Clip matrix, the 8x8 window of tracks and patterns at the session offsets
+# Playing patterns are green, patterns with notes amber, the arrows show where there is more
+#
+class SessionView:
+
+   def __init__(self, seq):
+      self.seq = seq
+
+   def column(self, x):
+      seq = self.seq
+      if(x == SIDE or seq.track_offset + x >= len(seq.tracks)): return [LED_OFF] * 8
+      trk = seq.tracks[seq.track_offset + x]
+      colours = []
+      for y in range(8):
+         p = seq.scene_offset + 7 - y
+         if(trk.patterns.isEmpty(p)): colours.append(LED_OFF)
+         elif(trk.active_pat == p): colours.append(GREEN_FULL)
+         else: colours.append(AMBER_FULL)
+      return colours
+
+   def top(self):
+      seq = self.seq
+      buttons = [LED_OFF] * 8
+      if(seq.scene_offset > 0): buttons[0] = AMBER_DIM
+      if(seq.scene_offset + 8 < len(seq.tracks[0].patterns)): buttons[1] = AMBER_DIM
+      if(seq.track_offset > 0): buttons[2] = AMBER_DIM
+      if(seq.track_offset + 8 < len(seq.tracks)): buttons[3] = AMBER_DIM
+      buttons[4] = GREEN_FULL
+      return buttons
+
+#
+# One page of the pattern being edited, a column per step and a row per note from the
+# editing offset up, black keys dim red. The side buttons show delete, stop and the octave
+#
+class EditView:
+
+   def __init__(self, seq):
+      self.seq = seq
+
+   def column(self, x):
+      seq = self.seq
+      if(x == SIDE): return self.side()
+      colours = [RED_DIM if (seq.editing_offset + y) % 12 in BLACK_KEYS else LED_OFF for y in range(8)]
+      pat = seq.editing_track.getPlayingPattern()
+      s = (seq.editing_page * 8) + x
+      if(s < len(pat.steps)):
+         y = pat.steps[s].note - seq.editing_offset
+         if(y >= 0 and y <= 7): colours[y] = AMBER_FULL
+      return colours
+
+   def side(self):
+      colours = [LED_OFF] * 8
+      colours[0] = RED_FULL
+      colours[3] = RED_FULL
+      n = int((self.seq.editing_offset - MIDDLE_C) / 8)
+      if(n < 0): colours[4] = OCTAVE_COLOURS[min(-n - 1, 4)]
+      else: colours[5] = OCTAVE_COLOURS[min(n, 4)]
+      return colours
+
+   def top(self):
+      seq = self.seq
+      buttons = [LED_OFF] * 8
+      for p in range(seq.editing_track.getPlayingPattern().countPages()): buttons[p] = AMBER_FULL
+      buttons[seq.editing_page] = RED_FULL
+      buttons[5] = GREEN_FULL
+      return buttons
+
+#
+# Tempo as a bar filling the grid, one pad per BPM_PER_BUTTON from BPM_OFFSET
+#
+class GlobalView:
+
+   def __init__(self, seq):
+      self.seq = seq
+
+   def column(self, x):
+      if(x == SIDE): return [LED_OFF] * 8
+      lit = int((self.seq.bpm - BPM_OFFSET) / BPM_PER_BUTTON) + 1
+      return [GREEN_FULL if (y * 8) + x < lit else LED_OFF for y in range(8)]
+
+   def top(self):
+      buttons = [LED_OFF] * 8
+      buttons[6] = GREEN_FULL
+      return buttons
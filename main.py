@@ -1,40 +1,31 @@
 import configparser 
 from lib.LaunchPad import *
 from lib.Sequencer import *
-import json
+from lib.AsyncRuntime import *
 import pprint
-import os
 
 # Load main config
 config = configparser.RawConfigParser()
 config.read('config.cfg')
 
-lp = LaunchPad(int(config['global']['lp_midi_in']), int(config['global']['lp_midi_out']))
+# 'threads' gives every part of the engine its own thread, 'asyncio' runs them all on one event loop,
+# 'process' moves the timing engine and MIDI output into a process of its own (lib/EngineProcess.py)
+threaded = config['global'].get('runtime', 'threads') != 'asyncio'
 
-lp.clear()
+# one writer thread per output port, shared by the Launchpad and the sequencer
+backend = WriterBackend(RtMidiBackend())
+lp = LaunchPad(int(config['global']['lp_midi_in']), int(config['global']['lp_midi_out']), backend, threaded)
+
+lp.reset()
 lp.setFlash(False)
-seq = Sequencer(lp, config)
+seq = Sequencer(lp, config, backend)
 
-# load data
-for t in range(8):
-   # skip missing files == default data
-   if(not os.path.isfile('data/track'+str(t)+'_data.json')): continue
-   
-   # load json data
-   json_file = open('data/track'+str(t)+'_data.json')
-   track_data = json.load(json_file)
-   pat_num = 0
-   # loop and deserialize into pattern and step data in each track
-   for pat in track_data['patterns']:
-      steps = pat['steps']
-      # wipe steps array to empty for appending back to full size
-      # steps array MUST still be 8, 16, 24 or 32 long
-      seq.tracks[t].patterns[pat_num].steps = []
-      for new_step in steps:
-         seq.tracks[t].patterns[pat_num].steps.append(Step(new_step['note'], new_step['vel'], new_step['gate']))
-         if(new_step['note'] != 0): seq.tracks[t].patterns[pat_num].note_count += 1
-      pat_num += 1
-      
-   json_file.close()
+# load data, from the binary session file if there is one, else the per track json files
+seq.loadSession()
+seq.startAutosave()
 
+lp.beginFrame()
 seq.startSessionMode()
+lp.commit()
+
+if(not threaded): AsyncRuntime(seq).run()
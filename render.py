@@ -0,0 +1,114 @@
+import argparse
+import configparser
+import multiprocessing
+import os
+import re
+import time
+from lib.Track import *
+from lib.Sequencer import MAX_TRACKS
+from lib.Session import *
+from lib.Render import *
+
+#
+# Batch renderer for archived sessions, no MIDI ports and no real time playback
+# Finds every data directory (trackN_data.json files or a session.bin) and every legacy
+# main.cfg under the given folders, then renders or validates them across all cores
+#
+
+DEFAULT_BPM = 120
+TRACK_FILE = re.compile(r'^track(\d+)_data\.json$')
+
+# Session dirs are (kind, path), kind is 'data' or 'legacy'
+def findSessions(roots):
+   sessions = []
+   for root in roots:
+      for dirpath, dirnames, filenames in os.walk(root):
+         dirnames.sort()
+         if('main.cfg' in filenames): sessions.append(('legacy', os.path.join(dirpath, 'main.cfg')))
+         if('session.bin' in filenames or any(TRACK_FILE.match(f) for f in filenames)): sessions.append(('data', dirpath))
+   return sessions
+
+def configBPM(path):
+   config = configparser.RawConfigParser()
+   config.read(path)
+   if(config.has_option('global', 'bpm')): return int(config['global']['bpm'])
+   return None
+
+# Data directory as saved by main.py, the bpm comes from the config.cfg next to it or above it
+def loadDataDir(path):
+   bpm = configBPM(os.path.join(path, 'config.cfg')) or configBPM(os.path.join(path, '..', 'config.cfg')) or DEFAULT_BPM
+   tracks = [Track(None, t) for t in range(MAX_TRACKS)]
+   session = Session(os.path.join(path, 'session.bin'))
+   if(session.exists() and session.load(tracks)): return tracks, bpm
+   for f in os.listdir(path):
+      match = TRACK_FILE.match(f)
+      if(match and int(match.group(1)) < len(tracks)): tracks[int(match.group(1))].loadJSON(os.path.join(path, f))
+   return tracks, bpm
+
+# Config written by old/sequencer.py, one section per track with 16 step patterns in 'data'
+def loadLegacy(path):
+   config = configparser.RawConfigParser()
+   config.read(path)
+   bpm = int(config['global']['bpm']) if config.has_option('global', 'bpm') else DEFAULT_BPM
+   tracks = []
+   for section in config.sections():
+      if(section == "global"): continue
+      trk = Track(None, int(config[section]['channel']) - 1)
+      trk.tracknum = len(tracks)
+      trk.timediv = float(config[section]['timediv'] if config.has_option(section, 'timediv') else 4)
+      gate = float(config[section]['gate'] if config.has_option(section, 'gate') else 0.5)
+      length = int(config[section]['pattern_len'] if config.has_option(section, 'pattern_len') else 16)
+      if(config.has_option(section, 'data') and len(config[section]['data']) > 0):
+         for p, pat in enumerate(config[section]['data'].split("|")[:len(trk.patterns)]):
+            notes = [int(n) for n in pat.split(",")][:length]
+            if(any(n != 0 for n in notes)):
+               trk.patterns[p].loadSteps([{"note": n, "vel": 127, "gate": gate} for n in notes])
+      tracks.append(trk)
+   return tracks, bpm
+
+def validate(tracks):
+   for t, trk in enumerate(tracks):
+      for p, pat in trk.patterns.items():
+         data = pat.data
+         where = "track {} pattern {}: ".format(t + 1, p + 1)
+         if(len(data) == 0 or len(data) > MAX_STEPS): raise ValueError(where + "{} steps".format(len(data)))
+         if(max(data.notes) > 127 or max(data.vels) > 127): raise ValueError(where + "note or velocity over 127")
+         # a gate of 0 is what the old sequencer saved for the knob all the way down, it still sounds
+         if(min(data.gates) < 0 or min(data.ratchets) < 1): raise ValueError(where + "gate or ratchet out of range")
+
+# Worker, returns (name, error or None, secs taken, secs of music)
+def renderOne(job):
+   kind, path, out_dir = job
+   start = time.perf_counter()
+   music = 0.0
+   try:
+      tracks, bpm = loadLegacy(path) if kind == 'legacy' else loadDataDir(path)
+      validate(tracks)
+      if(out_dir != None):
+         name = re.sub(r'[^A-Za-z0-9_.-]+', '_', os.path.relpath(path).strip('./')) or 'session'
+         music = Renderer(tracks, bpm).render(os.path.join(out_dir, name + '.mid'))
+      return path, None, time.perf_counter() - start, music
+   except Exception as e:
+      return path, "{}: {}".format(type(e).__name__, e), time.perf_counter() - start, music
+
+if __name__ == '__main__':
+   parser = argparse.ArgumentParser(description="Render or validate saved sessions to MIDI files, in parallel")
+   parser.add_argument('roots', nargs='+', help="folders to search for sessions")
+   parser.add_argument('--out', help="folder for the .mid files, leave out to only validate")
+   parser.add_argument('--jobs', type=int, default=os.cpu_count(), help="worker processes")
+   args = parser.parse_args()
+
+   if(args.out != None): os.makedirs(args.out, exist_ok=True)
+   jobs = [(kind, path, args.out) for kind, path in findSessions(args.roots)]
+   print("{} sessions, {} workers".format(len(jobs), args.jobs))
+
+   start = time.perf_counter()
+   failures = 0
+   with multiprocessing.Pool(args.jobs) as pool:
+      for path, error, secs, music in pool.imap_unordered(renderOne, jobs):
+         if(error == None):
+            print("  ok  {:>8.1f} ms  {:>7.1f} s music  {}".format(secs * 1000.0, music, path))
+         else:
+            failures += 1
+            print("FAIL  {:>8.1f} ms  {}  {}".format(secs * 1000.0, path, error))
+   print("{} done, {} failed in {:.2f} s".format(len(jobs), failures, time.perf_counter() - start))